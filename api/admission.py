@@ -0,0 +1,170 @@
+"""
+Controle de admissão (backpressure) para os endpoints de ingestão
+"""
+import os
+import signal
+import asyncio
+import itertools
+import threading
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from database import DB_POOL_SIZE, DB_MAX_OVERFLOW
+
+# Configuração do controle de admissão
+# O limite de ingestões simultâneas deve ficar abaixo do pool do banco
+# (pool_size + max_overflow do worker, em database.py) para que o checkout nunca enfileire
+INGEST_MAX_CONCURRENT = int(os.getenv(
+    "INGEST_MAX_CONCURRENT", str(max(1, min(8, DB_POOL_SIZE + DB_MAX_OVERFLOW - 2)))
+))
+INGEST_MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", "32"))
+INGEST_QUEUE_TIMEOUT = float(os.getenv("INGEST_QUEUE_TIMEOUT", "2.0"))
+INGEST_RETRY_AFTER = int(os.getenv("INGEST_RETRY_AFTER", "30"))
+# Tempo máximo para concluir as ingestões em andamento ao encerrar/recarregar um worker
+INGEST_DRAIN_TIMEOUT = float(os.getenv("INGEST_DRAIN_TIMEOUT", "30"))
+
+
+class AdmissionRejected(Exception):
+    """Requisição recusada: fila cheia ou tempo de espera esgotado"""
+
+    def __init__(self, reason: str, retry_after: int = INGEST_RETRY_AFTER):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionSuperseded(Exception):
+    """Inventário descartado porque chegou outro mais novo do mesmo dispositivo"""
+
+
+class AdmissionController:
+    """
+    Limita o número de ingestões simultâneas com uma fila de espera curta.
+
+    - Até `max_concurrent` ingestões executam ao mesmo tempo
+    - Até `max_queue` requisições aguardam por no máximo `queue_timeout` segundos
+    - O excedente é recusado imediatamente (AdmissionRejected)
+    - Enquanto aguardam, requisições do mesmo device_id são coalescidas:
+      apenas o inventário mais recente é processado (AdmissionSuperseded)
+    - Durante o encerramento (drain), novas requisições são recusadas e as
+      em andamento terminam normalmente
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._tickets = itertools.count()
+        self._newest: Dict[str, int] = {}
+        self.in_flight = 0
+        self.queued = 0
+        self.draining = False
+        self.admitted = 0
+        self.rejected = 0
+        self.coalesced = 0
+
+    def _forget(self, device_id: Optional[str], ticket: int):
+        if device_id and self._newest.get(device_id) == ticket:
+            del self._newest[device_id]
+
+    def precheck(self) -> None:
+        """
+        Recusa já (AdmissionRejected) se admit() recusaria agora, sem aguardar.
+        Chamado antes de parsear o corpo: com a fila cheia, o 503 sai sem esse custo
+        """
+        if self.draining:
+            self.rejected += 1
+            raise AdmissionRejected("server draining")
+        if self._semaphore.locked() and self.queued >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected("ingest queue full")
+
+    @asynccontextmanager
+    async def admit(self, device_id: Optional[str] = None):
+        """
+        Reserva uma vaga de ingestão para o dispositivo
+        Uso: async with ingest_admission.admit(device_id): ...
+        """
+        self.precheck()
+
+        ticket = next(self._tickets)
+        if device_id:
+            self._newest[device_id] = ticket
+
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            self._forget(device_id, ticket)
+            raise AdmissionRejected("ingest queue timeout")
+        finally:
+            self.queued -= 1
+
+        # Um inventário mais novo do mesmo dispositivo chegou enquanto este aguardava
+        if device_id and self._newest.get(device_id) != ticket:
+            self._semaphore.release()
+            self.coalesced += 1
+            raise AdmissionSuperseded(device_id)
+
+        self._forget(device_id, ticket)
+        self.admitted += 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def drain(self, timeout: float = INGEST_DRAIN_TIMEOUT) -> bool:
+        """
+        Para de admitir ingestões e aguarda as em andamento (e as que ainda
+        aguardam vaga). Retorna False se o tempo acabar antes.
+        """
+        self.draining = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (self.in_flight or self.queued) and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        return not (self.in_flight or self.queued)
+
+    def drain_on_signal(self, signals=(signal.SIGTERM, signal.SIGINT)) -> None:
+        """
+        Encadeia no handler de sinais do uvicorn: assim que o worker recebe
+        SIGTERM (reload/encerramento), novas ingestões já são recusadas com
+        Retry-After enquanto as em andamento terminam. Só no thread principal.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+        for sig in signals:
+            previous = signal.getsignal(sig)
+            if not callable(previous):
+                continue
+
+            def handler(signum, frame, previous=previous):
+                self.draining = True
+                previous(signum, frame)
+
+            signal.signal(sig, handler)
+
+    def stats(self) -> dict:
+        """Retorna o estado atual da fila de ingestão"""
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "coalesced": self.coalesced,
+            "draining": self.draining,
+        }
+
+
+# Instância compartilhada pelos endpoints de ingestão
+ingest_admission = AdmissionController(
+    max_concurrent=INGEST_MAX_CONCURRENT,
+    max_queue=INGEST_MAX_QUEUE,
+    queue_timeout=INGEST_QUEUE_TIMEOUT
+)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Snapshots colunares (Parquet) das tabelas normalizadas para BI
+Dashboards pesados passam a ler arquivos Parquet locais em vez das tabelas que a
+ingestão grava. A cada execução, apenas os dispositivos alterados desde a
+última (devices.updated_at, mantido por trigger) são reexportados:
+
+- Cada shard é lido em um snapshot REPEATABLE READ com COPY ... TO STDOUT
+  (streaming, memória constante) para arquivos CSV temporários
+- O DuckDB (embutido) mescla as linhas novas com o Parquet anterior: as linhas
+  dos dispositivos alterados são substituídas e as de dispositivos removidos
+  descartadas; cada arquivo é trocado atomicamente (os.replace)
+- snapshot.json guarda a marca d'água de cada shard e a contagem de linhas
+
+Layout em ANALYTICS_DIR: devices.parquet, software.parquet, hardware_storage.parquet,
+network_interfaces.parquet, logged_users.parquet e snapshot.json
+
+Uso: python3 analytics_snapshot.py [--full] [--interval SEGUNDOS]
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import duckdb
+
+from sharding import Shard, shards
+from analytics_state import ANALYTICS_DIR, ANALYTICS_TABLES, table_path, load_state, save_state
+
+logger = logging.getLogger("analytics_snapshot")
+
+# Margem sobre a marca d'água para transações que começaram antes dela e
+# terminaram depois (updated_at é o início da transação, não o commit)
+ANALYTICS_OVERLAP = float(os.getenv("ANALYTICS_OVERLAP", "300"))
+
+# Tipos do PostgreSQL -> DuckDB (o resto vira VARCHAR, ex.: inet, jsonb)
+_TYPES = {
+    "integer": "INTEGER",
+    "bigint": "BIGINT",
+    "smallint": "SMALLINT",
+    "boolean": "BOOLEAN",
+    "numeric": "DOUBLE",
+    "double precision": "DOUBLE",
+    "real": "FLOAT",
+    "date": "DATE",
+    "timestamp with time zone": "TIMESTAMPTZ",
+    "timestamp without time zone": "TIMESTAMP",
+}
+
+
+def _column_types(cursor, table: str) -> Dict[str, str]:
+    cursor.execute(
+        """
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+        ORDER BY ordinal_position
+        """,
+        (table,)
+    )
+    return {name: _TYPES.get(data_type, "VARCHAR") for name, data_type in cursor.fetchall()}
+
+
+def _copy_out(cursor, sql: str, path: str) -> None:
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true)", f)
+
+
+def extract_shard(shard: Shard, since: Optional[datetime], workdir: str) -> dict:
+    """
+    Exporta para CSV as linhas alteradas desde `since` (tudo, se None) e a
+    lista completa de device_id do shard. Devolve marca d'água e tipos.
+    """
+    conn = shard.engine.raw_connection()
+    try:
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        with conn.cursor() as cursor:
+            cursor.execute("SET LOCAL TIME ZONE 'UTC'")
+            cursor.execute("SELECT now()")
+            watermark = cursor.fetchone()[0]
+
+            changed = "TRUE" if since is None else cursor.mogrify(
+                "d.updated_at > %s", (since,)
+            ).decode("utf-8")
+            types = {table: _column_types(cursor, table) for table in ANALYTICS_TABLES}
+
+            _copy_out(cursor, f"SELECT d.* FROM devices d WHERE {changed}",
+                      os.path.join(workdir, f"devices.{shard.name}.csv"))
+            for table in ANALYTICS_TABLES[1:]:
+                _copy_out(
+                    cursor,
+                    f"SELECT c.* FROM {table} c JOIN devices d ON d.device_id = c.device_id WHERE {changed}",
+                    os.path.join(workdir, f"{table}.{shard.name}.csv")
+                )
+            _copy_out(cursor, "SELECT device_id FROM devices", os.path.join(workdir, f"ids.{shard.name}.csv"))
+        conn.rollback()
+    finally:
+        conn.close()
+    return {"watermark": watermark, "types": types}
+
+
+def _read_csv(files: List[str], types: Dict[str, str]) -> str:
+    columns = ", ".join(f"'{name}': '{kind}'" for name, kind in types.items())
+    file_list = ", ".join(f"'{path}'" for path in files)
+    return f"read_csv([{file_list}], header = true, columns = {{{columns}}})"
+
+
+def merge_table(db, table: str, files: List[str], types: Dict[str, str], directory: str, full: bool) -> int:
+    """Novo Parquet = anterior sem os dispositivos alterados/removidos + linhas novas"""
+    target = table_path(table, directory)
+    new_rows = f"SELECT * FROM {_read_csv(files, types)}"
+    if os.path.exists(target) and not full:
+        source = f"""
+            SELECT * FROM read_parquet('{target}')
+            WHERE device_id NOT IN (SELECT device_id FROM changed_ids)
+              AND device_id IN (SELECT device_id FROM current_ids)
+            UNION ALL BY NAME
+            {new_rows}
+        """
+    else:
+        source = new_rows
+
+    tmp = target + ".tmp"
+    db.execute(f"""
+        COPY (SELECT * FROM ({source}) ORDER BY device_id)
+        TO '{tmp}' (FORMAT parquet, COMPRESSION zstd)
+    """)
+    os.replace(tmp, target)
+    return db.execute(f"SELECT count(*) FROM read_parquet('{target}')").fetchone()[0]
+
+
+def run_snapshot(directory: str = ANALYTICS_DIR, full: bool = False) -> dict:
+    os.makedirs(directory, exist_ok=True)
+    state = load_state(directory)
+    start = time.perf_counter()
+    workdir = tempfile.mkdtemp(prefix="ocs-analytics-")
+    try:
+        extracted = {}
+        for shard in shards:
+            previous = None if full else state["watermarks"].get(shard.name)
+            since = None
+            if previous:
+                since = datetime.fromisoformat(previous) - timedelta(seconds=ANALYTICS_OVERLAP)
+            extracted[shard.name] = extract_shard(shard, since, workdir)
+
+        types = next(iter(extracted.values()))["types"]
+        names = list(extracted)
+        db = duckdb.connect()
+        try:
+            db.execute(f"""
+                CREATE TABLE changed_ids AS
+                SELECT device_id FROM {_read_csv([os.path.join(workdir, f"devices.{name}.csv") for name in names], types["devices"])}
+            """)
+            db.execute(f"""
+                CREATE TABLE current_ids AS
+                SELECT device_id FROM {_read_csv([os.path.join(workdir, f"ids.{name}.csv") for name in names], {"device_id": "VARCHAR"})}
+            """)
+            changed = db.execute("SELECT count(*) FROM changed_ids").fetchone()[0]
+
+            rows = {}
+            for table in ANALYTICS_TABLES:
+                files = [os.path.join(workdir, f"{table}.{name}.csv") for name in names]
+                rows[table] = merge_table(db, table, files, types[table], directory, full)
+        finally:
+            db.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    state = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "watermarks": {name: data["watermark"].isoformat() for name, data in extracted.items()},
+        "tables": rows,
+        "changed_devices": changed,
+        "elapsed_seconds": round(time.perf_counter() - start, 3),
+    }
+    # Por último: se algo falhar antes, a próxima execução reaplica as mesmas alterações
+    save_state(state, directory)
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta snapshots Parquet incrementais das tabelas normalizadas")
+    parser.add_argument("--directory", default=ANALYTICS_DIR, help=f"Diretório de saída (padrão: {ANALYTICS_DIR})")
+    parser.add_argument("--full", action="store_true", help="Ignora as marcas d'água e reexporta tudo")
+    parser.add_argument("--interval", type=float, default=0,
+                        help="Repete a cada N segundos (0 = executa uma vez)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    full = args.full
+    while True:
+        try:
+            state = run_snapshot(args.directory, full=full)
+            print(
+                f"Snapshot: {state['changed_devices']} dispositivos alterados em {state['elapsed_seconds']:.1f}s | "
+                + ", ".join(f"{table}={count}" for table, count in state["tables"].items()),
+                flush=True
+            )
+            full = False
+        except Exception as e:
+            logger.error(f"Falha no snapshot: {e}")
+            if not args.interval:
+                sys.exit(1)
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
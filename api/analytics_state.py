@@ -0,0 +1,30 @@
+"""
+Layout e estado dos snapshots Parquet (analytics_snapshot.py)
+Separado do gerador para a API servir os arquivos sem carregar o DuckDB.
+"""
+import os
+import json
+
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", "analytics")
+
+ANALYTICS_TABLES = ("devices", "software", "hardware_storage", "network_interfaces", "logged_users")
+STATE_FILE = "snapshot.json"
+
+
+def table_path(table: str, directory: str = ANALYTICS_DIR) -> str:
+    return os.path.join(directory, f"{table}.parquet")
+
+
+def load_state(directory: str = ANALYTICS_DIR) -> dict:
+    path = os.path.join(directory, STATE_FILE)
+    if not os.path.exists(path):
+        return {"watermarks": {}, "tables": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(state: dict, directory: str = ANALYTICS_DIR) -> None:
+    path = os.path.join(directory, STATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Reprocessamento de raw_inventory nas tabelas normalizadas
+Reconstrói devices/software/hardware_storage/network_interfaces/logged_users
+a partir dos payloads já armazenados, depois de mudanças na normalização
+(inventory.py) ou no schema.
+
+- Seleciona o payload mais recente de cada dispositivo (opcionalmente só os
+  recebidos em uma janela --since/--until), iterando por keyset em device_id
+- Aplica os lotes em paralelo com batch_writer (COPY + advisory lock por
+  device_id), sem sobrescrever dispositivos que receberam inventário novo
+- Se limita sozinho: espera enquanto o banco tem mais consultas ativas que
+  --max-active e usa lock_timeout para nunca segurar a ingestão online
+- Com vários shards (SHARD_DATABASE_URLS), processa um shard de cada vez;
+  --shard limita a um shard
+
+Uso: python3 backfill.py [--since DATA] [--until DATA] [--workers N] [--chunk-size N] [--shard NOME]
+"""
+import sys
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import create_engine, text
+
+from batch_writer import write_batch
+from sharding import shards, shards_by_name
+
+logger = logging.getLogger("backfill")
+
+APPLICATION_NAME = "ocs-backfill"
+
+
+def make_engine(url: str, workers: int):
+    """Pool próprio, identificado em pg_stat_activity pelo application_name"""
+    return create_engine(
+        url,
+        pool_pre_ping=True,
+        pool_size=workers + 1,
+        max_overflow=0,
+        connect_args={"application_name": APPLICATION_NAME}
+    )
+
+
+def iter_latest_payloads(engine, chunk_size: int, since: Optional[datetime],
+                         until: Optional[datetime], start_after: str = ""):
+    """
+    Keyset em device_id: a cada consulta, o payload mais recente dos próximos
+    `chunk_size` dispositivos. Nunca usa OFFSET nem mantém cursor aberto.
+    """
+    filters = ["device_id > :after"]
+    if since:
+        filters.append("received_at >= :since")
+    if until:
+        filters.append("received_at < :until")
+
+    query = text(f"""
+        SELECT DISTINCT ON (device_id) device_id, payload, received_at
+        FROM raw_inventory
+        WHERE {" AND ".join(filters)}
+        ORDER BY device_id, received_at DESC
+        LIMIT :limit
+    """)
+
+    after = start_after
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                query, {"after": after, "since": since, "until": until, "limit": chunk_size}
+            ).fetchall()
+        if not rows:
+            return
+        yield [
+            {"data": row.payload, "received_at": row.received_at}
+            for row in rows
+            if row.payload
+        ], rows[-1].device_id
+        after = rows[-1].device_id
+
+
+class Throttle:
+    """Segura novos lotes enquanto o banco está ocupado com outras consultas"""
+
+    def __init__(self, engine, max_active: int, pause: float):
+        self.engine = engine
+        self.max_active = max_active
+        self.pause = pause
+        self.waited = 0.0
+
+    def active_queries(self) -> int:
+        with self.engine.connect() as conn:
+            return conn.execute(text("""
+                SELECT count(*) FROM pg_stat_activity
+                WHERE datname = current_database()
+                  AND state = 'active'
+                  AND application_name <> :application_name
+                  AND pid <> pg_backend_pid()
+            """), {"application_name": APPLICATION_NAME}).scalar()
+
+    def wait(self) -> None:
+        if self.pause:
+            time.sleep(self.pause)
+        while self.max_active and self.active_queries() > self.max_active:
+            self.waited += 1.0
+            time.sleep(1.0)
+
+
+def apply_chunk(engine, items: List[dict], lock_timeout: str, retries: int = 3) -> int:
+    """Aplica um lote; se esbarrar em locks da ingestão online, recua e tenta de novo"""
+    for attempt in range(1, retries + 1):
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("SELECT set_config('lock_timeout', :value, true)"), {"value": lock_timeout})
+                return write_batch(conn, items, mode="reprocess")
+        except Exception as e:
+            if attempt == retries:
+                raise
+            logger.warning(f"Lote falhou (tentativa {attempt}/{retries}): {e}")
+            time.sleep(2 ** attempt)
+    return 0
+
+
+def run_backfill(url: str, workers: int, chunk_size: int, since: Optional[datetime], until: Optional[datetime],
+                 max_active: int, pause: float, lock_timeout: str, start_after: str = "") -> dict:
+    """Reprocessa um banco (shard)"""
+    engine = make_engine(url, workers)
+    throttle = Throttle(engine, max_active, pause)
+    stats = {"devices": 0, "rows": 0, "failed": 0, "resume_after": start_after}
+    lock = threading.Lock()
+    start = time.perf_counter()
+    # Lotes terminam fora de ordem: o ponto de retomada só avança sobre o
+    # prefixo de lotes concluídos com sucesso
+    chunks: List[list] = []
+
+    def done(future, chunk: list) -> None:
+        with lock:
+            count, last_device_id = chunk[0], chunk[1]
+            try:
+                stats["rows"] += future.result()
+                stats["devices"] += count
+                chunk[2] = "ok"
+            except Exception as e:
+                stats["failed"] += count
+                chunk[2] = "failed"
+                logger.error(f"Lote até {last_device_id} falhou: {e}")
+            while chunks and chunks[0][2] == "ok":
+                stats["resume_after"] = chunks.pop(0)[1]
+            elapsed = max(time.perf_counter() - start, 1e-9)
+            print(
+                f"Progresso: {stats['devices']} dispositivos, {stats['rows']} linhas, "
+                f"{stats['failed']} falhas | {stats['devices'] / elapsed:.1f} dispositivos/s "
+                f"| retomar após: {stats['resume_after'] or '-'}",
+                flush=True
+            )
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = set()
+        for items, last_device_id in iter_latest_payloads(engine, chunk_size, since, until, start_after):
+            # No máximo um lote por worker em andamento
+            while len(in_flight) >= workers:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            throttle.wait()
+
+            chunk = [len(items), last_device_id, None]
+            with lock:
+                chunks.append(chunk)
+            future = pool.submit(apply_chunk, engine, items, lock_timeout)
+            future.add_done_callback(lambda f, chunk=chunk: done(f, chunk))
+            in_flight.add(future)
+        wait(in_flight)
+
+    engine.dispose()
+    stats["elapsed"] = time.perf_counter() - start
+    stats["throttled_seconds"] = throttle.waited
+    return stats
+
+
+def parse_datetime(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprocessa raw_inventory nas tabelas normalizadas")
+    parser.add_argument("--since", type=parse_datetime, help="Só payloads recebidos a partir de (ISO 8601)")
+    parser.add_argument("--until", type=parse_datetime, help="Só payloads recebidos antes de (ISO 8601)")
+    parser.add_argument("--workers", type=int, default=4, help="Lotes aplicados em paralelo (padrão: 4)")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Dispositivos por lote (padrão: 500)")
+    parser.add_argument("--max-active", type=int, default=16,
+                        help="Pausa enquanto houver mais consultas ativas que isso no banco (0 = sem limite)")
+    parser.add_argument("--pause", type=float, default=0.0, help="Pausa fixa entre lotes, em segundos")
+    parser.add_argument("--lock-timeout", default="5s", help="lock_timeout de cada lote (padrão: 5s)")
+    parser.add_argument("--start-after", default="", help="Retoma após este device_id")
+    parser.add_argument("--shard", choices=list(shards_by_name), help="Processa apenas este shard")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    failed = False
+    for shard in [shards_by_name[args.shard]] if args.shard else shards:
+        if len(shards) > 1:
+            print(f"Shard {shard.name}")
+        stats = run_backfill(
+            url=shard.url,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            since=args.since,
+            until=args.until,
+            max_active=args.max_active,
+            pause=args.pause,
+            lock_timeout=args.lock_timeout,
+            start_after=args.start_after
+        )
+        print(
+            f"Concluído: {stats['devices']} dispositivos, {stats['rows']} linhas, "
+            f"{stats['failed']} falhas em {stats['elapsed']:.1f}s "
+            f"({stats['throttled_seconds']:.0f}s aguardando o banco)"
+        )
+        if stats["failed"]:
+            failed = True
+            shard_arg = f"--shard {shard.name} " if len(shards) > 1 else ""
+            print(f"Para retomar: python3 backfill.py {shard_arg}--start-after '{stats['resume_after']}' ...")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Gravação em lote de inventários com COPY
+Usada pelo importador de XML (bulk_import.py) e pelo reprocessamento de
+raw_inventory (backfill.py), com as mesmas regras de store_inventory:
+advisory lock por device_id, last-writer-wins e log de alterações (changes.py,
+só no modo "import").
+"""
+import io
+import json
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import text
+
+from inventory import DEVICE_COLUMNS, CHILD_TABLES, device_row, child_rows
+from device_cache import notify_sql
+from changes import TRACKED_DEVICE_COLUMNS, delete_children_sql, diff_inventory, record_changes
+from serialization import rows_to_dicts
+
+RAW_COLUMNS = ("device_id", "hostname", "payload", "received_at")
+STAGE_DEVICE_COLUMNS = DEVICE_COLUMNS + ("last_seen",)
+
+# Quando um dispositivo do lote já tem dados mais novos, ele não é aplicado:
+# - import: last_seen do dispositivo é mais novo que o arquivo importado
+# - reprocess: existe payload em raw_inventory mais novo que o reprocessado
+#   (last_seen é preservado, o reprocessamento não "rejuvenesce" o dispositivo)
+_UPSERT_GUARDS = {
+    "import": (
+        "last_seen = EXCLUDED.last_seen",
+        "devices.last_seen <= EXCLUDED.last_seen"
+    ),
+    "reprocess": (
+        "last_seen = GREATEST(devices.last_seen, EXCLUDED.last_seen)",
+        "NOT EXISTS (SELECT 1 FROM raw_inventory r "
+        "WHERE r.device_id = EXCLUDED.device_id AND r.received_at > EXCLUDED.last_seen)"
+    ),
+}
+
+
+def _copy_value(value) -> str:
+    """Formata um valor para COPY ... FROM STDIN (formato text)"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _copy_rows(cursor, table: str, columns: tuple, rows: List[dict]) -> None:
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(row[column]) for column in columns))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def _device_upsert_sql(mode: str) -> str:
+    last_seen, guard = _UPSERT_GUARDS[mode]
+    columns = ", ".join(DEVICE_COLUMNS)
+    updates = ",\n                ".join(
+        [f"{column} = EXCLUDED.{column}" for column in DEVICE_COLUMNS[1:]] + [last_seen]
+    )
+    return f"""
+        WITH applied AS (
+            INSERT INTO devices ({columns}, last_seen, first_seen)
+            SELECT {columns}, last_seen, last_seen FROM stage_devices
+            ON CONFLICT (device_id) DO UPDATE SET
+                {updates}
+            WHERE {guard}
+            RETURNING device_id
+        )
+        INSERT INTO stage_applied SELECT device_id FROM applied
+    """
+
+
+def write_batch(conn, items: List[dict], mode: str = "import") -> int:
+    """
+    Aplica um lote de inventários ({"data": dict, "received_at": datetime})
+    em uma transação já aberta. No modo "import" o payload bruto também é
+    guardado em raw_inventory; no modo "reprocess" ele já está lá.
+    Retorna o número de linhas gravadas.
+    """
+    # Apenas o inventário mais novo de cada dispositivo é normalizado
+    latest: Dict[str, dict] = {}
+    for item in items:
+        device_id = item["data"]["device_id"]
+        if device_id not in latest or item["received_at"] >= latest[device_id]["received_at"]:
+            latest[device_id] = item
+
+    device_rows = [
+        {**device_row(item["data"]), "last_seen": item["received_at"]}
+        for item in latest.values()
+    ]
+    children = {device_id: child_rows(item["data"]) for device_id, item in latest.items()}
+    table_rows: Dict[str, List[dict]] = {table: [] for table in CHILD_TABLES}
+    for device_children in children.values():
+        for table, rows in device_children.items():
+            table_rows[table].extend(rows)
+
+    # Tabelas temporárias com as mesmas colunas (sem constraints), descartadas no commit
+    conn.execute(text(
+        f"CREATE TEMP TABLE stage_devices ON COMMIT DROP AS "
+        f"SELECT {', '.join(STAGE_DEVICE_COLUMNS)} FROM devices WITH NO DATA"
+    ))
+    conn.execute(text("CREATE TEMP TABLE stage_applied (device_id VARCHAR(255)) ON COMMIT DROP"))
+    for table, (_, _, columns) in CHILD_TABLES.items():
+        conn.execute(text(
+            f"CREATE TEMP TABLE stage_{table} ON COMMIT DROP AS "
+            f"SELECT {', '.join(columns)} FROM {table} WITH NO DATA"
+        ))
+
+    store_raw = mode == "import"
+    if store_raw:
+        conn.execute(text(
+            f"CREATE TEMP TABLE stage_raw ON COMMIT DROP AS "
+            f"SELECT {', '.join(RAW_COLUMNS)} FROM raw_inventory WITH NO DATA"
+        ))
+
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        if store_raw:
+            _copy_rows(cursor, "stage_raw", RAW_COLUMNS, [
+                {
+                    "device_id": item["data"]["device_id"],
+                    "hostname": item["data"]["hostname"],
+                    "payload": json.dumps(item["data"], default=str),
+                    "received_at": item["received_at"]
+                }
+                for item in items
+            ])
+        _copy_rows(cursor, "stage_devices", STAGE_DEVICE_COLUMNS, device_rows)
+        for table, (_, _, columns) in CHILD_TABLES.items():
+            _copy_rows(cursor, f"stage_{table}", columns, table_rows[table])
+    finally:
+        cursor.close()
+
+    # Mesmo lock de store_inventory, adquirido em ordem fixa para não haver deadlock
+    conn.execute(text("""
+        SELECT pg_advisory_xact_lock(lock_key)
+        FROM (SELECT hashtext(device_id) AS lock_key FROM stage_devices ORDER BY 1) keys
+    """))
+
+    # Estado anterior dos dispositivos do lote, para o log de alterações. O
+    # reprocessamento não gera eventos (como rebalance.py): o que muda nele é a
+    # normalização, não o inventário, e cada correção viraria uma rajada nos webhooks
+    track_changes = mode == "import"
+    previous = {}
+    if track_changes:
+        previous = {
+            row["device_id"]: row
+            for row in rows_to_dicts(conn.execute(text(
+                f"SELECT device_id, {', '.join(TRACKED_DEVICE_COLUMNS)} FROM devices "
+                f"WHERE device_id IN (SELECT device_id FROM stage_devices)"
+            )))
+        }
+
+    written = 0
+    if store_raw:
+        written += conn.execute(text(f"""
+            INSERT INTO raw_inventory ({', '.join(RAW_COLUMNS)})
+            SELECT {', '.join(RAW_COLUMNS)} FROM stage_raw
+            ON CONFLICT (device_id, received_at) DO NOTHING
+        """)).rowcount
+    written += conn.execute(text(_device_upsert_sql(mode))).rowcount
+    applied = conn.execute(text("SELECT device_id FROM stage_applied")).scalars().all()
+
+    old_children: Dict[str, Dict[str, List[dict]]] = {device_id: {} for device_id in applied}
+    for table, (_, _, columns) in CHILD_TABLES.items():
+        where = "device_id IN (SELECT device_id FROM stage_applied)"
+        deleted = conn.execute(text(
+            delete_children_sql(table, where) if track_changes else f"DELETE FROM {table} WHERE {where}"
+        ))
+        if deleted.returns_rows:
+            for device_id in applied:
+                old_children[device_id][table] = []
+            for row in rows_to_dicts(deleted):
+                old_children[row["device_id"]][table].append(row)
+        written += conn.execute(text(f"""
+            INSERT INTO {table} ({', '.join(columns)})
+            SELECT {', '.join(columns)} FROM stage_{table}
+            WHERE device_id IN (SELECT device_id FROM stage_applied)
+            ON CONFLICT DO NOTHING
+        """)).rowcount
+
+    # Invalida os caches de dispositivos dos workers da API (entregue no commit)
+    conn.execute(text(f"{notify_sql('device_id')} FROM stage_applied"))
+
+    if track_changes:
+        record_changes(conn, [
+            change
+            for device_id in applied
+            for change in diff_inventory(
+                device_id, previous.get(device_id), device_row(latest[device_id]["data"]),
+                old_children[device_id], children[device_id]
+            )
+        ])
+
+    return written
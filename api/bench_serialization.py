@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark da serialização de /api/devices
+Compara o caminho antigo (DeviceResponse por linha + revalidação do
+response_model + jsonable_encoder/json.dumps) com o caminho orjson direto.
+Usa linhas sintéticas no formato do SELECT de list_devices (não precisa de banco).
+
+Uso: python3 bench_serialization.py [REPETICOES]
+"""
+import sys
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from pydantic import TypeAdapter
+
+from models import DeviceResponse
+from serialization import result_to_json
+
+COLUMNS = [
+    "id", "device_id", "hostname", "ip_address", "os_name", "os_version",
+    "manufacturer", "model", "cpu_name", "cpu_cores", "ram_mb",
+    "last_seen", "first_seen"
+]
+
+
+class FakeResult:
+    """Imita o Result do SQLAlchemy: keys() + iteração por tuplas"""
+
+    def __init__(self, rows):
+        self._rows = rows
+
+    def keys(self):
+        return COLUMNS
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+def build_rows(count: int) -> list:
+    now = datetime.now(timezone.utc)
+    return [
+        (
+            i, f"DEVICE{i:06d}", f"workstation-{i}", f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+            "Windows 10", "10.0.19045", "Dell Inc.", "OptiPlex 7090",
+            "Intel Core i7-10700", 8, 16384,
+            now - timedelta(minutes=i), now - timedelta(days=30)
+        )
+        for i in range(count)
+    ]
+
+
+response_adapter = TypeAdapter(List[DeviceResponse])
+
+
+def serialize_before(result) -> bytes:
+    """Caminho anterior: modelo por linha, revalidação e encoder padrão"""
+    devices = []
+    for row in result:
+        row = dict(zip(COLUMNS, row))
+        devices.append(DeviceResponse(
+            id=row["id"],
+            device_id=row["device_id"],
+            hostname=row["hostname"],
+            ip_address=str(row["ip_address"]) if row["ip_address"] else None,
+            os_name=row["os_name"],
+            os_version=row["os_version"],
+            manufacturer=row["manufacturer"],
+            model=row["model"],
+            cpu_name=row["cpu_name"],
+            cpu_cores=row["cpu_cores"],
+            ram_mb=row["ram_mb"],
+            last_seen=row["last_seen"],
+            first_seen=row["first_seen"]
+        ))
+    # O que o FastAPI faz com response_model antes de responder
+    validated = response_adapter.validate_python(devices, from_attributes=True)
+    content = response_adapter.dump_python(validated, mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def serialize_after(result) -> bytes:
+    """Caminho novo: linhas direto para bytes via orjson"""
+    return result_to_json(result)
+
+
+def measure(func, rows, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(FakeResult(rows))
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    print(f"{'linhas':>8} {'antes (µs/linha)':>18} {'depois (µs/linha)':>18} {'ganho':>8}")
+    for count in (1000, 10000):
+        rows = build_rows(count)
+        # Ambos os caminhos precisam produzir o mesmo documento
+        assert json.loads(serialize_before(FakeResult(rows))) == json.loads(serialize_after(FakeResult(rows)))
+
+        before = measure(serialize_before, rows, repeat) / count * 1e6
+        after = measure(serialize_after, rows, repeat) / count * 1e6
+        print(f"{count:>8} {before:>18.2f} {after:>18.2f} {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Importador em lote de arquivos XML do agente OCS (planos ou compactados com zlib)
+Usado em migração de sites e recuperação após indisponibilidade.
+
+- O parsing (parse_ocs_xml) é distribuído em um pool de processos
+- As linhas normalizadas são gravadas com COPY em tabelas temporárias e
+  aplicadas em lote, com as mesmas regras de store_inventory
+  (advisory lock por device_id e last-writer-wins pela data do arquivo);
+  com vários shards, cada lote é dividido pelo shard dono de cada dispositivo
+- Um arquivo de checkpoint registra os arquivos já importados, permitindo retomar
+
+Uso: python3 bulk_import.py DIRETORIO [--workers N] [--batch-size N] [--checkpoint ARQUIVO]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import List, Optional, Set
+
+from inventory import child_rows
+from batch_writer import write_batch
+from sharding import group_by_shard
+from ocs_xml import parse_ocs_xml, decompress_ocs_body
+from inventory_store import store_inventory_in_shard
+
+logger = logging.getLogger("bulk_import")
+
+DEFAULT_EXTENSIONS = (".xml", ".ocs", ".zlib", ".gz")
+# Arquivos entregues a cada tarefa do pool de processos
+FILES_PER_TASK = 50
+# Logam uma linha por arquivo (descompressão/armazenamento): só poluem a importação
+PER_FILE_LOGGERS = ("ocs_xml", "inventory_store")
+
+
+def quiet_per_file_logs() -> None:
+    """Também usado como initializer do pool (processos criados por spawn não herdam o nível)"""
+    for name in PER_FILE_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+# ---------------------------------------------------------------------------
+# Parsing (executado nos processos do pool)
+# ---------------------------------------------------------------------------
+
+def parse_file(path: str) -> dict:
+    """Lê, descompacta e parseia um arquivo salvo do agente OCS"""
+    try:
+        with open(path, "rb") as f:
+            body = f.read()
+        if not body.lstrip().startswith(b"<"):
+            body = decompress_ocs_body(body)
+
+        xml_content = body.decode("utf-8", errors="ignore").strip()
+        if "<QUERY>PROLOG" in xml_content and "<HARDWARE>" not in xml_content:
+            return {"path": path, "data": None, "error": None}
+
+        data = parse_ocs_xml(xml_content)
+        if not data.get("device_id"):
+            return {"path": path, "data": None, "error": "missing HARDWARE/UUID"}
+
+        received_at = datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc)
+        return {"path": path, "data": data, "received_at": received_at, "error": None}
+    except Exception as e:
+        detail = getattr(e, "detail", None) or str(e)
+        return {"path": path, "data": None, "error": detail}
+
+
+def parse_files(paths: List[str]) -> List[dict]:
+    return [parse_file(path) for path in paths]
+
+
+# ---------------------------------------------------------------------------
+# Gravação (processo principal)
+# ---------------------------------------------------------------------------
+
+def write_one_by_one(parsed: List[dict]) -> tuple:
+    """Fallback quando o lote falha: grava arquivo a arquivo para isolar o problemático"""
+    written, done = 0, []
+    for item in parsed:
+        try:
+            store_inventory_in_shard(item["data"], item["received_at"])
+            written += 1 + sum(len(rows) for rows in child_rows(item["data"]).values())
+            done.append(item["path"])
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            logger.error(f"Falha ao gravar {item['path']}: {detail}")
+    return written, done
+
+
+# ---------------------------------------------------------------------------
+# Checkpoint e orquestração
+# ---------------------------------------------------------------------------
+
+def load_checkpoint(path: Optional[str]) -> Set[str]:
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+def save_checkpoint(checkpoint, paths: List[str]) -> None:
+    if checkpoint is None or not paths:
+        return
+    checkpoint.write("".join(f"{path}\n" for path in paths))
+    checkpoint.flush()
+    os.fsync(checkpoint.fileno())
+
+
+def discover_files(directory: str, extensions: tuple) -> List[str]:
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.lower().endswith(extensions):
+                files.append(os.path.join(root, name))
+    files.sort()
+    return files
+
+
+class Progress:
+    def __init__(self, total: int):
+        self.total = total
+        self.files = 0
+        self.rows = 0
+        self.failed = 0
+        self.start = time.perf_counter()
+
+    def report(self, final: bool = False) -> None:
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        label = "Concluído" if final else "Progresso"
+        print(
+            f"{label}: {self.files}/{self.total} arquivos, {self.failed} falhas, "
+            f"{self.rows} linhas | {self.files / elapsed:.1f} arquivos/s, "
+            f"{self.rows / elapsed:.1f} linhas/s, {elapsed:.1f}s",
+            flush=True
+        )
+
+
+def run_import(directory: str, workers: int, batch_size: int, checkpoint_path: Optional[str],
+               extensions: tuple = DEFAULT_EXTENSIONS) -> Progress:
+    already_done = load_checkpoint(checkpoint_path)
+    files = [path for path in discover_files(directory, extensions) if path not in already_done]
+    print(f"{len(files)} arquivos para importar ({len(already_done)} já no checkpoint)")
+
+    progress = Progress(len(files))
+    tasks = [files[i:i + FILES_PER_TASK] for i in range(0, len(files), FILES_PER_TASK)]
+    checkpoint = open(checkpoint_path, "a", encoding="utf-8") if checkpoint_path else None
+
+    def flush(batch: List[dict], skipped: List[str]) -> None:
+        written, done = 0, []
+        for shard, items in group_by_shard(batch, lambda item: item["data"]["device_id"]).items():
+            try:
+                with shard.engine.begin() as conn:
+                    written += write_batch(conn, items)
+                done += [item["path"] for item in items]
+            except Exception as e:
+                logger.warning(
+                    f"Lote com {len(items)} arquivos falhou no shard {shard.name} ({e}); "
+                    f"gravando individualmente"
+                )
+                shard_written, shard_done = write_one_by_one(items)
+                written += shard_written
+                done += shard_done
+                progress.failed += len(items) - len(shard_done)
+        save_checkpoint(checkpoint, done + skipped)
+        progress.files += len(batch) + len(skipped)
+        progress.rows += written
+        progress.report()
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=quiet_per_file_logs) as pool:
+            # Janela limitada de tarefas em andamento: memória constante
+            pending = deque()
+            task_iter = iter(tasks)
+            for task in task_iter:
+                pending.append(pool.submit(parse_files, task))
+                if len(pending) >= workers * 2:
+                    break
+
+            batch: List[dict] = []
+            skipped: List[str] = []
+            while pending:
+                for result in pending.popleft().result():
+                    if result["error"]:
+                        logger.error(f"Falha ao ler {result['path']}: {result['error']}")
+                        progress.failed += 1
+                        progress.files += 1
+                    elif result["data"] is None:
+                        skipped.append(result["path"])
+                    else:
+                        batch.append(result)
+
+                next_task = next(task_iter, None)
+                if next_task is not None:
+                    pending.append(pool.submit(parse_files, next_task))
+
+                if len(batch) >= batch_size:
+                    flush(batch, skipped)
+                    batch, skipped = [], []
+
+            if batch or skipped:
+                flush(batch, skipped)
+    finally:
+        if checkpoint:
+            checkpoint.close()
+
+    progress.report(final=True)
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa em lote arquivos XML do agente OCS")
+    parser.add_argument("directory", help="Diretório com os arquivos XML (busca recursiva)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4,
+                        help="Processos de parsing (padrão: número de CPUs)")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="Inventários por transação/COPY (padrão: 1000)")
+    parser.add_argument("--checkpoint", default="bulk_import.checkpoint",
+                        help="Arquivo de checkpoint para retomar a importação")
+    parser.add_argument("--extensions", default=",".join(DEFAULT_EXTENSIONS),
+                        help="Extensões consideradas, separadas por vírgula")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    quiet_per_file_logs()
+
+    if not os.path.isdir(args.directory):
+        print(f"Erro: diretório {args.directory} não encontrado.")
+        sys.exit(1)
+
+    extensions = tuple(ext.strip().lower() for ext in args.extensions.split(",") if ext.strip())
+    progress = run_import(args.directory, args.workers, args.batch_size, args.checkpoint, extensions)
+    sys.exit(1 if progress.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
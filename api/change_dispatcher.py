@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Entrega do log de alterações (changes.py) a um webhook, em lotes
+Para consumidores (CMDB, SIEM) que preferem receber as alterações em vez de
+consultar /api/changes. Lê direto dos shards, com o mesmo cursor do endpoint:
+
+- Cada lote (até --batch alterações) vai em um POST JSON
+  {"changes": [...], "cursor": "..."}; 2xx confirma a entrega
+- Falhas (rede, timeout, resposta não-2xx) são repetidas com backoff
+  exponencial, sempre com o mesmo lote: entrega "ao menos uma vez" — o
+  receptor descarta repetições por (shard, seq)
+- O cursor confirmado fica em CHANGES_STATE_FILE; reiniciar continua de onde parou
+- Com CHANGES_WEBHOOK_SECRET, o corpo é assinado (HMAC-SHA256) no header X-OCS-Signature
+- A retenção (CHANGES_RETENTION_DAYS) roda na API; --prune a aplica uma vez (cron)
+
+Uso: python3 change_dispatcher.py [--url URL] [--batch N] [--from-now] [--prune]
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import hashlib
+import logging
+import argparse
+import urllib.error
+import urllib.request
+from typing import Optional
+
+from changes import (
+    CHANGES_RETENTION_DAYS, ChangesExpired, decode_position, encode_position, head_position, prune_changes, read_changes
+)
+from serialization import to_json
+
+logger = logging.getLogger("change_dispatcher")
+
+CHANGES_WEBHOOK_URL = os.getenv("CHANGES_WEBHOOK_URL", "")
+CHANGES_WEBHOOK_SECRET = os.getenv("CHANGES_WEBHOOK_SECRET", "")
+CHANGES_WEBHOOK_TIMEOUT = float(os.getenv("CHANGES_WEBHOOK_TIMEOUT", "10"))
+# Espera máxima entre tentativas de um lote que falhou (segundos)
+CHANGES_WEBHOOK_MAX_BACKOFF = float(os.getenv("CHANGES_WEBHOOK_MAX_BACKOFF", "300"))
+CHANGES_STATE_FILE = os.getenv("CHANGES_STATE_FILE", "changes_webhook.json")
+
+
+def load_cursor(path: str) -> Optional[str]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("cursor")
+
+
+def save_cursor(path: str, cursor: str) -> None:
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"cursor": cursor, "saved_at": time.time()}, f)
+    os.replace(path + ".tmp", path)
+
+
+def post_batch(url: str, body: bytes, secret: str = CHANGES_WEBHOOK_SECRET) -> None:
+    """POST do lote; exceção se o receptor não confirmar com 2xx"""
+    headers = {"Content-Type": "application/json", "User-Agent": "ocs-inventory-api/changes"}
+    if secret:
+        digest = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        headers["X-OCS-Signature"] = f"sha256={digest}"
+    request = urllib.request.Request(url, data=body, headers=headers, method="POST")
+    with urllib.request.urlopen(request, timeout=CHANGES_WEBHOOK_TIMEOUT) as response:
+        if not 200 <= response.status < 300:
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+
+
+def deliver(url: str, page: dict) -> int:
+    """Entrega o lote, repetindo até conseguir; devolve o número de tentativas"""
+    body = to_json(page)
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            post_batch(url, body)
+            return attempt
+        except Exception as e:
+            delay = min(2 ** attempt, CHANGES_WEBHOOK_MAX_BACKOFF)
+            logger.warning(
+                f"Falha ao entregar {len(page['changes'])} alterações (tentativa {attempt}): {e}; "
+                f"nova tentativa em {delay:.0f}s"
+            )
+            time.sleep(delay)
+
+
+def run_dispatcher(url: str, batch: int, interval: float, state_file: str, from_now: bool) -> None:
+    cursor = load_cursor(state_file)
+    if cursor is None and from_now:
+        # Gravado já: reiniciar antes da primeira entrega não pula alterações
+        positions = head_position()
+        save_cursor(state_file, encode_position(positions))
+    else:
+        positions = decode_position(cursor)
+
+    while True:
+        page = read_changes(positions, batch)
+        if not page["changes"]:
+            time.sleep(interval)
+            continue
+
+        attempts = deliver(url, page)
+        positions = decode_position(page["cursor"])
+        save_cursor(state_file, page["cursor"])
+        print(
+            f"Entregues {len(page['changes'])} alterações ({attempts} tentativa(s)) | cursor {page['cursor']}",
+            flush=True
+        )
+        if not page["has_more"]:
+            time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Entrega o log de alterações de inventário a um webhook")
+    parser.add_argument("--url", default=CHANGES_WEBHOOK_URL, help="Endpoint do webhook (padrão: CHANGES_WEBHOOK_URL)")
+    parser.add_argument("--batch", type=int, default=500, help="Alterações por POST (padrão: 500)")
+    parser.add_argument("--interval", type=float, default=2.0,
+                        help="Espera entre consultas quando não há alterações (segundos)")
+    parser.add_argument("--state-file", default=CHANGES_STATE_FILE, help="Arquivo com o cursor já entregue")
+    parser.add_argument("--from-now", action="store_true",
+                        help="Sem cursor salvo, começa pelas alterações futuras em vez do início do log")
+    parser.add_argument("--prune", action="store_true", help="Apenas aplica a retenção e sai (para cron)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.prune:
+        removed = prune_changes(CHANGES_RETENTION_DAYS)
+        print(
+            f"Retenção ({CHANGES_RETENTION_DAYS:g} dias): "
+            + ", ".join(f"{name}={count}" for name, count in removed.items())
+        )
+        return
+    if not args.url:
+        parser.error("informe --url ou CHANGES_WEBHOOK_URL")
+
+    try:
+        run_dispatcher(args.url, max(1, args.batch), args.interval, args.state_file, args.from_now)
+    except ChangesExpired as e:
+        # O receptor perdeu alterações: precisa ressincronizar (ex.: /api/export) e apagar o arquivo de estado
+        logger.error(f"{e} (apague {args.state_file} após ressincronizar)")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
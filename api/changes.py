@@ -0,0 +1,395 @@
+"""
+Log de alterações dos dispositivos (device_changes) e feed incremental /api/changes
+store_inventory() e batch_writer comparam o inventário recebido com o que estava
+gravado e registram apenas o que mudou:
+
+- device_added: primeiro inventário do dispositivo (sem eventos por item)
+- software_installed / software_removed / software_updated (mesmo nome, outra versão)
+- hardware_changed: fabricante, modelo, série, CPU, RAM ou discos
+- os_changed: nome, versão ou arquitetura do sistema operacional
+
+As gravações não se serializam entre si. Cada linha guarda o txid da
+transação que a gravou (xid8) e o feed é lido na ordem (txid, seq), só até o
+horizonte das transações já terminadas: um commit tardio nunca fica atrás de
+um cursor já entregue. Uma transação longa com escrita segura o feed (atrasa,
+não perde) até terminar. O cursor guarda a posição em cada shard
+("7524.120" com um shard, "shard0:7524.120,shard1:8011.98" com vários).
+
+Rebalanceamento (rebalance.py) e reprocessamento (backfill.py) não geram
+eventos: o histórico de um dispositivo movido fica no shard antigo até a
+retenção (CHANGES_RETENTION_DAYS) o remover. A retenção guarda a maior
+posição já removida (device_changes_pruned): só um cursor anterior a ela
+perdeu alterações e recebe 410.
+"""
+import os
+import json
+import heapq
+import asyncio
+import logging
+import itertools
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from serialization import rows_to_dicts
+from sharding import Shard, shards, shards_by_name, scatter
+
+logger = logging.getLogger(__name__)
+
+# Alterações por página de /api/changes (o cliente pode pedir menos)
+CHANGES_MAX_RESULTS = int(os.getenv("CHANGES_MAX_RESULTS", "1000"))
+# Tempo máximo de espera do long-poll (?wait=, segundos)
+CHANGES_MAX_WAIT = float(os.getenv("CHANGES_MAX_WAIT", "30"))
+# Releitura durante o long-poll caso a notificação não chegue (ex.: sem LISTEN)
+CHANGES_POLL_INTERVAL = float(os.getenv("CHANGES_POLL_INTERVAL", "2"))
+# Alterações mais antigas que isso são removidas pela API (changes_pruner)
+CHANGES_RETENTION_DAYS = float(os.getenv("CHANGES_RETENTION_DAYS", "30"))
+# Intervalo entre execuções da retenção (segundos)
+CHANGES_PRUNE_INTERVAL = float(os.getenv("CHANGES_PRUNE_INTERVAL", "3600"))
+
+# Notificado no commit de cada lote de alterações (acorda os long-polls)
+CHANGES_CHANNEL = "ocs_device_changes"
+
+OS_COLUMNS = ("os_name", "os_version", "os_architecture")
+HARDWARE_COLUMNS = ("manufacturer", "model", "serial_number", "cpu_name", "cpu_cores", "ram_mb")
+# Colunas de devices lidas antes do upsert para comparação
+TRACKED_DEVICE_COLUMNS = OS_COLUMNS + HARDWARE_COLUMNS
+
+# Colunas comparadas por tabela filha (as demais tabelas não geram eventos)
+TRACKED_CHILD_COLUMNS = {
+    "software": ("name", "version"),
+    "hardware_storage": ("disk_name", "disk_type", "capacity_gb", "serial_number"),
+}
+
+_INSERT_SQL = text("""
+    INSERT INTO device_changes (device_id, change_type, detail)
+    SELECT c.change->>'device_id', c.change->>'change_type', c.change->'detail'
+    FROM jsonb_array_elements(CAST(:changes AS jsonb)) WITH ORDINALITY AS c(change, n)
+    ORDER BY c.n
+""")
+
+# Horizonte de visibilidade: só transações com txid abaixo da mais antiga ainda
+# em andamento (xmin do snapshot). Essas já terminaram, então nenhuma alteração
+# com (txid, seq) menor que a última entregue pode aparecer depois.
+_VISIBLE = "txid < pg_snapshot_xmin(pg_current_snapshot())"
+
+_READ_SQL = text(f"""
+    SELECT txid::text AS txid, seq, device_id, change_type, detail, changed_at
+    FROM device_changes
+    WHERE (txid, seq) > (CAST(:txid AS xid8), :seq) AND {_VISIBLE}
+    ORDER BY txid, seq
+    LIMIT :limit
+""")
+
+_HEAD_SQL = text(f"""
+    SELECT txid::text AS txid, seq FROM device_changes
+    WHERE {_VISIBLE}
+    ORDER BY txid DESC, seq DESC
+    LIMIT 1
+""")
+
+
+_PRUNED_SQL = text("SELECT txid::text AS txid, seq FROM device_changes_pruned")
+
+# Remove pela idade e avança a marca da retenção para a maior posição removida
+_PRUNE_SQL = text("""
+    WITH deleted AS (
+        DELETE FROM device_changes
+        WHERE changed_at < now() - make_interval(secs => :seconds)
+        RETURNING txid, seq
+    ),
+    mark AS (
+        INSERT INTO device_changes_pruned (id, txid, seq)
+        SELECT true, txid, seq FROM deleted ORDER BY txid DESC, seq DESC LIMIT 1
+        ON CONFLICT (id) DO UPDATE SET txid = EXCLUDED.txid, seq = EXCLUDED.seq
+        WHERE (device_changes_pruned.txid, device_changes_pruned.seq) < (EXCLUDED.txid, EXCLUDED.seq)
+    )
+    SELECT count(*) FROM deleted
+""")
+
+
+_PRUNE_LOCK = "ocs_device_changes_prune"
+
+
+class ChangesExpired(ValueError):
+    """O cursor aponta para alterações já removidas pela retenção (vira 410)"""
+
+
+def delete_children_sql(table: str, where: str) -> str:
+    """DELETE das linhas antigas de uma tabela filha, devolvendo as colunas comparadas"""
+    sql = f"DELETE FROM {table} WHERE {where}"
+    if table in TRACKED_CHILD_COLUMNS:
+        sql += f" RETURNING device_id, {', '.join(TRACKED_CHILD_COLUMNS[table])}"
+    return sql
+
+
+def _norm(value) -> Optional[str]:
+    """XML/JSON trazem números como texto; o banco devolve int"""
+    if value is None or value == "":
+        return None
+    return str(value)
+
+
+def _software_changes(old: List[dict], new: List[dict]) -> List[Tuple[str, dict]]:
+    old_keys = {(_norm(row["name"]), _norm(row.get("version"))) for row in old}
+    new_keys = {(_norm(row["name"]), _norm(row.get("version"))) for row in new}
+    removed = sorted(old_keys - new_keys, key=str)
+    installed = sorted(new_keys - old_keys, key=str)
+
+    # Mesmo nome saindo e entrando uma vez cada: atualização, não remoção + instalação
+    removed_names = [name for name, _ in removed]
+    installed_names = [name for name, _ in installed]
+    updated = {
+        name for name in set(removed_names) & set(installed_names)
+        if removed_names.count(name) == 1 and installed_names.count(name) == 1
+    }
+    old_versions = {name: version for name, version in removed if name in updated}
+
+    changes = []
+    for name, version in installed:
+        if name in updated:
+            changes.append(("software_updated", {"name": name, "from": old_versions[name], "to": version}))
+        else:
+            changes.append(("software_installed", {"name": name, "version": version}))
+    changes += [
+        ("software_removed", {"name": name, "version": version})
+        for name, version in removed if name not in updated
+    ]
+    return changes
+
+
+def _hardware_changes(old_device: dict, new_device: dict, old: List[dict], new: List[dict]) -> Optional[dict]:
+    detail = {}
+    fields = {
+        column: {"from": old_device.get(column), "to": new_device.get(column)}
+        for column in HARDWARE_COLUMNS
+        if _norm(old_device.get(column)) != _norm(new_device.get(column))
+    }
+    if fields:
+        detail["fields"] = fields
+
+    columns = TRACKED_CHILD_COLUMNS["hardware_storage"]
+    old_disks = {row["disk_name"]: tuple(_norm(row.get(c)) for c in columns) for row in old}
+    new_disks = {row["disk_name"]: tuple(_norm(row.get(c)) for c in columns) for row in new}
+    for key, names in (
+        ("disks_added", new_disks.keys() - old_disks.keys()),
+        ("disks_removed", old_disks.keys() - new_disks.keys()),
+        ("disks_changed", {name for name in old_disks.keys() & new_disks.keys() if old_disks[name] != new_disks[name]}),
+    ):
+        if names:
+            detail[key] = sorted(names)
+    return detail or None
+
+
+def diff_inventory(device_id: str, old_device: Optional[dict], new_device: dict,
+                   old_children: Dict[str, List[dict]], new_children: Dict[str, List[dict]]) -> List[dict]:
+    """
+    Alterações entre o estado gravado (old_*, None se o dispositivo é novo) e o
+    inventário aplicado. Filhas: linhas de child_rows() / delete_children_sql().
+    """
+    if old_device is None:
+        changes = [("device_added", {"hostname": new_device.get("hostname")})]
+    else:
+        changes = []
+        os_fields = {
+            column: {"from": old_device.get(column), "to": new_device.get(column)}
+            for column in OS_COLUMNS
+            if _norm(old_device.get(column)) != _norm(new_device.get(column))
+        }
+        if os_fields:
+            changes.append(("os_changed", os_fields))
+        hardware = _hardware_changes(
+            old_device, new_device,
+            old_children.get("hardware_storage", []), new_children.get("hardware_storage", [])
+        )
+        if hardware:
+            changes.append(("hardware_changed", hardware))
+        changes += _software_changes(old_children.get("software", []), new_children.get("software", []))
+
+    return [{"device_id": device_id, "change_type": kind, "detail": detail} for kind, detail in changes]
+
+
+def record_changes(conn, changes: List[dict]) -> int:
+    """
+    Grava as alterações na transação aberta (Session ou Connection). Sem lock:
+    gravações concorrentes seguem em paralelo; a ordem para os leitores vem
+    do txid (ver read_changes).
+    """
+    if not changes:
+        return 0
+    conn.execute(_INSERT_SQL, {"changes": json.dumps(changes, default=str)})
+    conn.execute(text(f"SELECT pg_notify('{CHANGES_CHANNEL}', '')"))
+    return len(changes)
+
+
+# ---------------------------------------------------------------------------
+# Cursor e leitura do feed
+# ---------------------------------------------------------------------------
+
+# Posição em um shard: (txid, seq) da última alteração lida; (0, 0) = início
+Position = Tuple[int, int]
+_START: Position = (0, 0)
+
+
+def _format(position: Position) -> str:
+    return f"{position[0]}.{position[1]}"
+
+
+def _parse(value: str) -> Position:
+    txid, _, seq = value.strip().partition(".")
+    position = int(txid), int(seq)
+    if min(position) < 0:
+        raise ValueError(f"Invalid position: {value}")
+    return position
+
+
+def encode_position(positions: Dict[str, Position]) -> str:
+    """Cursor do feed: posição (txid.seq) já lida em cada shard"""
+    if len(shards) == 1:
+        return _format(positions.get(shards[0].name, _START))
+    return ",".join(f"{shard.name}:{_format(positions.get(shard.name, _START))}" for shard in shards)
+
+
+def decode_position(cursor: Optional[str]) -> Dict[str, Position]:
+    """Inverso de encode_position (None = início do log); ValueError se inválido"""
+    if not cursor:
+        return {}
+    if ":" not in cursor:
+        if len(shards) > 1:
+            raise ValueError("Cursor must name the shard of each position (shard:txid.seq,...)")
+        return {shards[0].name: _parse(cursor)}
+    positions = {}
+    for part in cursor.split(","):
+        name, _, position = part.partition(":")
+        # Shards retirados do anel são ignorados; shards novos começam do início
+        if name.strip() in shards_by_name:
+            positions[name.strip()] = _parse(position)
+    return positions
+
+
+def head_position() -> Dict[str, Position]:
+    """Posição atual (última alteração visível) de cada shard, para seguir "a partir de agora\""""
+    def fetch(shard: Shard) -> Position:
+        with shard.engine.connect() as conn:
+            row = conn.execute(_HEAD_SQL).first()
+        return (int(row.txid), row.seq) if row else _START
+
+    return {shard.name: position for shard, position in zip(shards, scatter(fetch))}
+
+
+def read_changes(positions: Dict[str, Position], limit: int) -> dict:
+    """
+    Próximas `limit` alterações após `positions`, intercaladas por changed_at.
+    Lê do primário: a notificação que acorda o long-poll vem dele, e a réplica
+    ainda poderia não ter as linhas.
+    """
+    def fetch(shard: Shard) -> List[dict]:
+        txid, seq = positions.get(shard.name, _START)
+        with shard.engine.connect() as conn:
+            # Perdeu alterações só quem ainda não tinha lido até a última removida;
+            # o início do log (since vazio) segue do que a retenção manteve
+            pruned = conn.execute(_PRUNED_SQL).first()
+            if seq and pruned and (txid, seq) < (int(pruned.txid), pruned.seq):
+                raise ChangesExpired(
+                    f"Changes after {shard.name}:{_format((txid, seq))} were removed by retention; "
+                    f"resync and restart from since=now"
+                )
+            rows = rows_to_dicts(conn.execute(_READ_SQL, {"txid": str(txid), "seq": seq, "limit": limit + 1}))
+        for row in rows:
+            row["shard"] = shard.name
+        return rows
+
+    results = scatter(fetch)
+    # Cada shard já vem em ordem de (txid, seq); o merge preserva essa ordem por shard
+    merged = heapq.merge(*results, key=lambda row: row["changed_at"])
+    page = list(itertools.islice(merged, limit))
+
+    cursor = dict(positions)
+    for row in page:
+        cursor[row["shard"]] = (int(row.pop("txid")), row["seq"])
+    return {
+        "changes": page,
+        "cursor": encode_position(cursor),
+        "has_more": sum(len(rows) for rows in results) > len(page),
+    }
+
+
+def prune_changes(days: float = CHANGES_RETENTION_DAYS) -> Dict[str, int]:
+    """Remove alterações mais antigas que a retenção; devolve quantas por shard"""
+    def prune(shard: Shard) -> int:
+        with shard.engine.begin() as conn:
+            # Vários workers (e o change_dispatcher) rodam a retenção: um por vez basta
+            if not conn.execute(text(f"SELECT pg_try_advisory_xact_lock(hashtext('{_PRUNE_LOCK}'))")).scalar():
+                return 0
+            return conn.execute(_PRUNE_SQL, {"seconds": days * 86400}).scalar()
+
+    return {shard.name: count for shard, count in zip(shards, scatter(prune))}
+
+
+class ChangeSignal:
+    """
+    Acorda os long-polls de /api/changes deste worker quando o listener
+    (device_cache.InvalidationListener) recebe CHANGES_CHANNEL
+    """
+
+    def __init__(self):
+        self._event: Optional[asyncio.Event] = None
+
+    def arm(self) -> asyncio.Event:
+        """Chamado antes de ler o log: notificações durante a leitura não se perdem"""
+        if self._event is None:
+            self._event = asyncio.Event()
+        return self._event
+
+    def notify(self) -> None:
+        if self._event is not None:
+            self._event.set()
+            self._event = None
+
+    @staticmethod
+    async def wait(event: asyncio.Event, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+change_signal = ChangeSignal()
+
+
+class ChangesPruner:
+    """
+    Aplica a retenção (CHANGES_RETENTION_DAYS) em segundo plano na API, a cada
+    CHANGES_PRUNE_INTERVAL segundos, sem depender do change_dispatcher
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                removed = await loop.run_in_executor(None, prune_changes, CHANGES_RETENTION_DAYS)
+                if any(removed.values()):
+                    logger.info(f"Retenção: {sum(removed.values())} alterações antigas removidas")
+            except Exception as e:
+                logger.warning(f"Falha na retenção do log de alterações: {e}")
+            await asyncio.sleep(CHANGES_PRUNE_INTERVAL)
+
+    def start(self) -> None:
+        if CHANGES_RETENTION_DAYS > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+changes_pruner = ChangesPruner()
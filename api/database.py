@@ -2,9 +2,16 @@
 Configuração de conexão com PostgreSQL usando SQLAlchemy
 """
 import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Optional
+from fastapi import Request
 from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from contextlib import contextmanager
 
 # Configuração do banco de dados
@@ -13,17 +20,102 @@ DATABASE_URL = os.getenv(
     "postgresql://ocsuser:ocspassword@db:5432/ocsinventory"
 )
 
+# Processos (workers) da API; definido por serve.py para cada worker
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Conexões que todos os workers juntos podem abrir em cada banco (primário,
+# réplica ou shard). Cada worker fica com DB_CONNECTION_BUDGET / WEB_CONCURRENCY,
+# incluindo a conexão LISTEN do cache de dispositivos; do restante, 1/3 fica
+# no pool e o resto como overflow (padrão: 9 + 20 com 1 worker).
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "30"))
+# Mínimo por worker: LISTEN + 2 no pool
+DB_MIN_CONNECTIONS_PER_WORKER = 3
+# Mais workers que isso não cabem no orçamento (serve.py limita ou recusa)
+DB_MAX_WORKERS = max(1, DB_CONNECTION_BUDGET // DB_MIN_CONNECTIONS_PER_WORKER)
+
+
+class ConnectionBudgetError(RuntimeError):
+    """WEB_CONCURRENCY maior do que DB_CONNECTION_BUDGET comporta"""
+
+
+def pool_sizes(workers: int) -> tuple:
+    """(pool_size, max_overflow) de cada worker com `workers` processos dividindo o orçamento"""
+    if workers > DB_MAX_WORKERS:
+        raise ConnectionBudgetError(
+            f"{workers} workers não cabem em DB_CONNECTION_BUDGET={DB_CONNECTION_BUDGET} "
+            f"({DB_MIN_CONNECTIONS_PER_WORKER} conexões por worker): use no máximo {DB_MAX_WORKERS} "
+            f"workers ou aumente DB_CONNECTION_BUDGET (e o max_connections do PostgreSQL)"
+        )
+    pooled = max(2, DB_CONNECTION_BUDGET // max(workers, 1) - 1)
+    pool_size = max(1, pooled // 3)
+    return pool_size, pooled - pool_size
+
+
+DB_POOL_SIZE, DB_MAX_OVERFLOW = pool_sizes(WEB_CONCURRENCY)
+# Abre as conexões do pool no startup, antes de receber tráfego
+DB_POOL_PREWARM = os.getenv("DB_POOL_PREWARM", "true").lower() in ("1", "true", "yes")
+
+# Pooler externo: "pgbouncer" (modo transaction). Nada de estado de sessão:
+# sem prepared statements no servidor e LISTEN direto no PostgreSQL
+DB_POOLER = os.getenv("DB_POOLER", "").lower()
+# Conexão direta (sem pooler), usada para LISTEN quando DB_POOLER=pgbouncer
+DIRECT_DATABASE_URL = os.getenv("DIRECT_DATABASE_URL")
+
+
+def engine_options(url: str) -> dict:
+    """Opções de create_engine com o pool dimensionado pelo orçamento do worker"""
+    options = {
+        "pool_pre_ping": True,  # Verifica conexão antes de usar
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+    }
+    # psycopg2 nunca prepara statements no servidor; o psycopg 3 prepara
+    # automaticamente após algumas execuções, o que quebra no pgbouncer em modo transaction
+    if DB_POOLER == "pgbouncer" and url.startswith("postgresql+psycopg:"):
+        options["connect_args"] = {"prepare_threshold": None}
+    return options
+
+
+def listen_url(url: str) -> Optional[str]:
+    """URL para LISTEN/NOTIFY: atrás do pgbouncer, só a conexão direta recebe notificações"""
+    if DB_POOLER != "pgbouncer":
+        return url
+    if url == DATABASE_URL:
+        return DIRECT_DATABASE_URL
+    return None
+
+
 # Engine do SQLAlchemy
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,  # Verifica conexão antes de usar
-    pool_size=10,
-    max_overflow=20
-)
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
 
 # Session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Réplica de leitura (opcional): rotas GET usam este pool quando configurado
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
+# Acima deste atraso de replicação (segundos) as leituras voltam para o primário
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "5"))
+# Intervalo entre verificações do atraso (segundos)
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", "2"))
+# Tempo máximo de conexão/consulta da verificação (segundos)
+REPLICA_CHECK_TIMEOUT = float(os.getenv("REPLICA_CHECK_TIMEOUT", "2"))
+# Sem mensagem do primário há mais que isso, o receptor de WAL é considerado parado
+# (o primário envia keepalive a cada wal_sender_timeout / 2, 30s por padrão)
+REPLICA_RECEIVER_TIMEOUT = float(os.getenv("REPLICA_RECEIVER_TIMEOUT", "60"))
+# Clientes que acabaram de ingerir leem do primário durante esta janela (segundos)
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", "10"))
+# /api/ingest devolve o momento da gravação; o cliente o reenvia (cookie ou header)
+LAST_WRITE_COOKIE = "ocs_last_write"
+LAST_WRITE_HEADER = "X-Last-Write"
+
+if READ_DATABASE_URL:
+    read_engine = create_engine(READ_DATABASE_URL, **engine_options(READ_DATABASE_URL))
+else:
+    read_engine = engine
+
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+logger = logging.getLogger(__name__)
+
 # Base para modelos ORM (se necessário no futuro)
 Base = declarative_base()
 
@@ -63,3 +155,155 @@ def test_connection():
         print(f"Erro ao conectar no banco: {e}")
         return False
 
+
+def prewarm_pool(engine, count: int = DB_POOL_SIZE) -> int:
+    """Abre `count` conexões e as devolve ao pool; retorna quantas foram abertas"""
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(engine.connect())
+    except Exception as e:
+        logger.warning(f"Pré-aquecimento do pool interrompido ({engine.url.host}): {e}")
+    finally:
+        for conn in connections:
+            conn.close()
+    return len(connections)
+
+
+class ReplicaMonitor:
+    """
+    Acompanha o atraso de replicação da réplica de leitura.
+    Uma única tarefa em segundo plano (start()) verifica a cada
+    REPLICA_LAG_CHECK_INTERVAL segundos; as requisições só leem o último
+    resultado. Réplica sem resposta, sem receber WAL do primário ou cuja
+    última verificação ficou velha é considerada indisponível.
+    """
+
+    def __init__(self):
+        self.lag: Optional[float] = None
+        self.available = False
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._engine = None
+        if READ_DATABASE_URL:
+            # Conexão própria, fora do pool das requisições: a verificação nunca espera
+            # por uma conexão livre e tem timeout de conexão próprio
+            connect_args = dict(engine_options(READ_DATABASE_URL).get("connect_args", {}))
+            connect_args["connect_timeout"] = max(1, int(REPLICA_CHECK_TIMEOUT))
+            self._engine = create_engine(READ_DATABASE_URL, poolclass=NullPool, connect_args=connect_args)
+
+    def check(self) -> None:
+        # Verificações concorrentes não se acumulam: quem chega depois usa o resultado atual
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            with self._engine.begin() as conn:
+                conn.execute(
+                    text("SELECT set_config('statement_timeout', :value, true)"),
+                    {"value": str(int(REPLICA_CHECK_TIMEOUT * 1000))}
+                )
+                # Réplica sem nada pendente para aplicar está em dia (mesmo com o
+                # primário ocioso) só se ainda estiver recebendo WAL: com o receptor
+                # desconectado, receive_lsn = replay_lsn também vale e os dados envelhecem.
+                # pg_stat_wal_receiver exige superusuário ou pg_read_all_stats.
+                lag = conn.execute(text("""
+                    SELECT CASE
+                        WHEN NOT pg_is_in_recovery() THEN 0
+                        WHEN NOT COALESCE((
+                            SELECT status = 'streaming'
+                               AND last_msg_receipt_time > now() - make_interval(secs => :silence)
+                            FROM pg_stat_wal_receiver
+                        ), false) THEN NULL
+                        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                    END
+                """), {"silence": REPLICA_RECEIVER_TIMEOUT}).scalar()
+            self.lag = float(lag) if lag is not None else None
+            self.available = lag is not None
+            if lag is None:
+                logger.warning("Réplica de leitura sem receber WAL do primário")
+        except Exception as e:
+            logger.warning(f"Réplica de leitura indisponível: {e}")
+            self.available = False
+            self.lag = None
+        finally:
+            self.checked_at = time.monotonic()
+            self._lock.release()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await loop.run_in_executor(None, self.check)
+            await asyncio.sleep(REPLICA_LAG_CHECK_INTERVAL)
+
+    def start(self) -> None:
+        if READ_DATABASE_URL is not None and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def healthy(self) -> bool:
+        if READ_DATABASE_URL is None:
+            return False
+        # Resultado velho (verificação travada ou monitor parado) não vale
+        fresh = time.monotonic() - self.checked_at < 3 * REPLICA_LAG_CHECK_INTERVAL + REPLICA_CHECK_TIMEOUT
+        return fresh and self.available and self.lag is not None and self.lag <= REPLICA_MAX_LAG
+
+    def status(self) -> str:
+        if READ_DATABASE_URL is None:
+            return "not configured"
+        if not self.healthy():
+            if self.available and self.lag is not None and self.lag > REPLICA_MAX_LAG:
+                return f"lagging ({self.lag:.1f}s)"
+            return "unavailable"
+        return f"ok ({self.lag:.1f}s)"
+
+
+replica_monitor = ReplicaMonitor()
+
+
+def use_replica(last_write: Optional[float] = None) -> bool:
+    """
+    Decide se uma leitura pode ir para a réplica.
+    last_write: epoch da última ingestão do cliente (read-your-writes)
+    """
+    if READ_DATABASE_URL is None:
+        return False
+    if last_write is not None and time.time() - last_write < READ_YOUR_WRITES_WINDOW:
+        return False
+    return replica_monitor.healthy()
+
+
+def last_write_of(request: Request) -> Optional[float]:
+    """Epoch da última ingestão do cliente (cookie ou header), se informado"""
+    value = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE)
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def recent_write(request: Request) -> bool:
+    """Cliente ingeriu dados há menos de READ_YOUR_WRITES_WINDOW segundos"""
+    last_write = last_write_of(request)
+    return last_write is not None and time.time() - last_write < READ_YOUR_WRITES_WINDOW
+
+
+def get_read_db(request: Request):
+    """
+    Dependency para rotas de leitura: réplica quando saudável, senão primário
+    Uso: db: Session = Depends(get_read_db)
+    """
+    db = ReadSessionLocal() if use_replica(last_write_of(request)) else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,312 @@
+"""
+Cache LRU das visões de dispositivos, invalidado entre workers via LISTEN/NOTIFY
+store_inventory() (e as ferramentas em lote) emitem pg_notify por device_id
+alterado; cada worker do uvicorn mantém uma conexão LISTEN por shard que
+invalida o seu próprio cache. Notificações em rajada são coalescidas antes de aplicar.
+A mesma conexão recebe CHANGES_CHANNEL e acorda os long-polls de /api/changes.
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+import psycopg2
+import psycopg2.extensions
+from sqlalchemy.engine import make_url
+
+from database import REPLICA_MAX_LAG
+from sharding import shards
+from changes import CHANGES_CHANNEL, change_signal
+
+logger = logging.getLogger(__name__)
+
+# Canal usado por store_inventory / batch_writer
+NOTIFY_CHANNEL = "ocs_device_changed"
+# Entradas no cache (0 desativa)
+DEVICE_CACHE_SIZE = int(os.getenv("DEVICE_CACHE_SIZE", "5000"))
+# Limite de memória das respostas em cache (bytes)
+DEVICE_CACHE_MAX_BYTES = int(os.getenv("DEVICE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Validade máxima de uma entrada, caso alguma notificação se perca (segundos)
+DEVICE_CACHE_TTL = float(os.getenv("DEVICE_CACHE_TTL", "300"))
+# Janela para coalescer rajadas de notificações (segundos)
+DEVICE_CACHE_COALESCE = float(os.getenv("DEVICE_CACHE_COALESCE", "0.05"))
+
+# Chave das páginas de /api/devices: qualquer alteração as invalida
+LIST_KEY = "__list__"
+
+
+def notify_sql(device_id_expr: str) -> str:
+    """SQL que notifica a alteração (entregue no commit, descartada no rollback)"""
+    return (
+        f"SELECT pg_notify('{NOTIFY_CHANNEL}', "
+        f"extract(epoch from clock_timestamp())::text || ':' || {device_id_expr})"
+    )
+
+
+class DeviceCache:
+    """LRU de respostas já serializadas (bytes), por device_id ou página da listagem"""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        # Última invalidação por dispositivo (e da listagem), para não cachear
+        # leituras que começaram antes dela ou da réplica que ainda pode estar atrasada
+        self._invalidated_at: Dict[str, float] = {}
+        # Invalidações anteriores a isto foram esquecidas (limpeza de _invalidated_at
+        # ou clear()): leituras iniciadas antes não são cacheadas
+        self._forgotten_before = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.notifications = 0
+        self.bursts = 0
+        self.lag_samples = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        # Uma conexão LISTEN por shard; o cache só é usado com todas conectadas
+        self.listeners_total = 0
+        self.listeners_connected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @property
+    def listener_connected(self) -> bool:
+        return self.listeners_total > 0 and self.listeners_connected == self.listeners_total
+
+    def get(self, key: Hashable) -> Optional[Tuple[bytes, Optional[dict]]]:
+        """(conteúdo, headers) da resposta em cache, ou None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        content, stored_at, headers = entry
+        if time.monotonic() - stored_at > self.ttl:
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return content, headers
+
+    def put(self, key: Hashable, group: str, content: bytes, read_started: float,
+            from_replica: bool = False, headers: Optional[dict] = None) -> None:
+        """
+        Guarda uma resposta. `group` é o device_id (ou LIST_KEY) cuja
+        invalidação descarta a entrada; `read_started` é o time.monotonic()
+        de antes da leitura: se uma invalidação chegou durante a leitura, o
+        resultado pode ser o anterior a ela e não é guardado.
+        """
+        if not self.enabled or not self.listener_connected or len(content) > self.max_bytes:
+            return
+        if read_started <= self._forgotten_before:
+            return
+        invalidated_at = self._invalidated_at.get(group)
+        if invalidated_at is not None:
+            if invalidated_at >= read_started:
+                return
+            if from_replica and time.monotonic() - invalidated_at < REPLICA_MAX_LAG:
+                return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (content, time.monotonic(), headers)
+        self._bytes += len(content)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        content, _, _ = self._entries.pop(key)
+        self._bytes -= len(content)
+
+    def invalidate(self, device_ids: Set[str]) -> None:
+        now = time.monotonic()
+        for device_id in device_ids:
+            self._invalidated_at[device_id] = now
+            if device_id in self._entries:
+                self._remove(device_id)
+                self.invalidations += 1
+        # Páginas da listagem dependem de last_seen de todos os dispositivos
+        self._invalidated_at[LIST_KEY] = now
+        for key in [key for key in self._entries if isinstance(key, tuple) and key[0] == LIST_KEY]:
+            self._remove(key)
+            self.invalidations += 1
+        # Marcas de invalidação só importam dentro da janela de atraso da réplica
+        if len(self._invalidated_at) > 10 * max(self.max_entries, 1):
+            self._forgotten_before = now - REPLICA_MAX_LAG
+            self._invalidated_at = {
+                key: at for key, at in self._invalidated_at.items() if now - at < REPLICA_MAX_LAG
+            }
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+        # Leituras em andamento podem ter perdido notificações
+        self._forgotten_before = time.monotonic()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "listener_connected": self.listener_connected,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "memory_bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "notifications": self.notifications,
+            "notification_bursts": self.bursts,
+            "invalidation_lag_avg_ms": (self.lag_total / self.lag_samples * 1000) if self.lag_samples else 0.0,
+            "invalidation_lag_max_ms": self.lag_max * 1000,
+        }
+
+
+class InvalidationListener:
+    """
+    Conexão LISTEN dedicada (fora do pool), integrada ao event loop via add_reader.
+    Se a conexão cair, o cache é esvaziado (notificações podem ter sido perdidas)
+    e fica desativado até reconectar. Roda mesmo com o cache desativado, para o
+    feed de alterações.
+    """
+
+    def __init__(self, cache: DeviceCache, url: str, reconnect_delay: float = 5.0):
+        self.cache = cache
+        self.url = make_url(url)
+        self.reconnect_delay = reconnect_delay
+        self._connected = False
+        self._conn = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Dict[str, float] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._lost = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self.cache.listeners_total += 1
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self.cache.listeners_total -= 1
+
+    def _connect(self):
+        conn = psycopg2.connect(
+            **self.url.translate_connect_args(username="user", database="dbname")
+        )
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            cursor.execute(f"LISTEN {CHANGES_CHANNEL}")
+        return conn
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                self._conn = await loop.run_in_executor(None, self._connect)
+                self._lost = loop.create_future()
+                loop.add_reader(self._conn.fileno(), self._on_readable)
+                self.cache.clear()
+                self._connected = True
+                self.cache.listeners_connected += 1
+                logger.info(f"✓ Cache de dispositivos escutando invalidações ({self.url.host})")
+                # Alterações gravadas enquanto estava desconectado: os long-polls releem
+                change_signal.notify()
+                await self._lost
+            except asyncio.CancelledError:
+                self._close()
+                raise
+            except Exception as e:
+                logger.warning(f"Listener do cache indisponível: {e}")
+            self._close()
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _close(self) -> None:
+        if self._connected:
+            self._connected = False
+            self.cache.listeners_connected -= 1
+        self.cache.clear()
+        if self._conn is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self._conn.fileno())
+            except Exception:
+                pass
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _on_readable(self) -> None:
+        try:
+            self._conn.poll()
+        except Exception as e:
+            logger.warning(f"Conexão LISTEN perdida: {e}")
+            if self._lost and not self._lost.done():
+                self._lost.set_result(None)
+            return
+
+        now = time.time()
+        while self._conn.notifies:
+            notify = self._conn.notifies.pop(0)
+            if notify.channel == CHANGES_CHANNEL:
+                change_signal.notify()
+                continue
+            sent_at, _, device_id = notify.payload.partition(":")
+            try:
+                sent_at = float(sent_at)
+            except ValueError:
+                sent_at = now
+            # Rajadas do mesmo dispositivo viram uma invalidação (guarda o envio mais antigo)
+            self._pending.setdefault(device_id, sent_at)
+            self.cache.notifications += 1
+
+        if self._pending and self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                DEVICE_CACHE_COALESCE, self._flush
+            )
+
+    def _flush(self) -> None:
+        self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        self.cache.invalidate(set(pending))
+        self.cache.bursts += 1
+
+        now = time.time()
+        for sent_at in pending.values():
+            lag = max(now - sent_at, 0.0)
+            self.cache.lag_samples += 1
+            self.cache.lag_total += lag
+            self.cache.lag_max = max(self.cache.lag_max, lag)
+
+
+# Sem conexão direta para LISTEN em algum shard (pgbouncer em modo transaction
+# sem DIRECT_DATABASE_URL), as invalidações se perderiam: cache desativado
+_listen_urls = [shard.listen_url for shard in shards]
+if not all(_listen_urls):
+    logger.warning("Cache de dispositivos desativado: defina DIRECT_DATABASE_URL para usar LISTEN com pgbouncer")
+
+device_cache = DeviceCache(
+    DEVICE_CACHE_SIZE if all(_listen_urls) else 0, DEVICE_CACHE_MAX_BYTES, DEVICE_CACHE_TTL
+)
+invalidation_listeners: List[InvalidationListener] = [
+    InvalidationListener(device_cache, url) for url in _listen_urls if url
+]
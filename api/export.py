@@ -0,0 +1,155 @@
+"""
+Exportação em streaming do inventário completo (NDJSON / CSV)
+Lê com cursores server-side (fetch limitado) e comprime em gzip sob demanda,
+então o uso de memória não depende do tamanho do parque. Com vários shards,
+cada um é exportado em sequência (cada shard com o seu próprio snapshot).
+"""
+import os
+import io
+import csv
+import zlib
+from typing import Dict, Iterable, Iterator, List
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+
+from serialization import to_json
+
+# Linhas buscadas por FETCH em cada cursor server-side
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "2000"))
+# Bytes acumulados antes de entregar um bloco ao cliente
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# Tabelas exportáveis em CSV
+EXPORT_TABLES = ("devices", "software", "hardware_storage", "network_interfaces", "logged_users")
+
+# Seções aninhadas no NDJSON: chave no documento -> (tabela, colunas)
+NESTED_SECTIONS = {
+    "software": ("software", "name, version, publisher, install_date"),
+    "storage": ("hardware_storage", "disk_name, disk_type, capacity_gb, serial_number"),
+    "network_interfaces": (
+        "network_interfaces",
+        "interface_name, mac_address, ip_address, netmask, gateway, dhcp_enabled, status"
+    ),
+    "logged_users": ("logged_users", "username, domain, last_login"),
+}
+
+
+def _snapshot(conn):
+    """Transação somente leitura: todos os cursores enxergam o mesmo snapshot"""
+    return conn.execution_options(
+        isolation_level="REPEATABLE READ",
+        postgresql_readonly=True,
+        yield_per=EXPORT_FETCH_SIZE
+    )
+
+
+def _stream_rows(conn, sql: str) -> Iterator[tuple]:
+    result = conn.execute(text(sql))
+    keys = list(result.keys())
+    for row in result:
+        yield keys, row
+
+
+def _buffered(parts: Iterable[bytes]) -> Iterator[bytes]:
+    """Agrupa pedaços pequenos em blocos de ~64KB"""
+    buffer = bytearray()
+    for part in parts:
+        buffer += part
+        if len(buffer) >= EXPORT_CHUNK_BYTES:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def gzip_stream(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Comprime um fluxo de bytes em gzip incrementalmente"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def iter_devices_ndjson(engines: List) -> Iterator[bytes]:
+    """
+    Um documento JSON por linha: device + software/storage/NICs/usuários.
+    Os cursores dos filhos são lidos em paralelo, ordenados por device_id,
+    e casados com o cursor de devices (merge join sem carregar tudo em memória).
+    """
+    for engine in engines:
+        yield from _iter_shard_ndjson(engine)
+
+
+def _iter_shard_ndjson(engine) -> Iterator[bytes]:
+    with engine.connect() as conn:
+        conn = _snapshot(conn)
+        with conn.begin():
+            children: Dict[str, Iterator] = {}
+            pending: Dict[str, tuple] = {}
+            for section, (table, columns) in NESTED_SECTIONS.items():
+                children[section] = _stream_rows(
+                    conn, f"SELECT device_id, {columns} FROM {table} ORDER BY device_id, id"
+                )
+                pending[section] = next(children[section], None)
+
+            def parts():
+                for keys, row in _stream_rows(conn, "SELECT * FROM devices ORDER BY device_id"):
+                    document = dict(zip(keys, row))
+                    device_id = document["device_id"]
+                    for section in NESTED_SECTIONS:
+                        items: List[dict] = []
+                        # Todo filho pertence a um device do mesmo snapshot (FK),
+                        # então basta consumir enquanto o device_id coincidir
+                        while pending[section] is not None and pending[section][1][0] == device_id:
+                            child_keys, child_row = pending[section]
+                            items.append(dict(zip(child_keys[1:], child_row[1:])))
+                            pending[section] = next(children[section], None)
+                        document[section] = items
+                    yield to_json(document) + b"\n"
+
+            yield from _buffered(parts())
+
+
+def iter_table_csv(table: str, engines: List) -> Iterator[bytes]:
+    """CSV plano de uma tabela, com cabeçalho (uma vez, mesmo com vários shards)"""
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown export table: {table}")
+
+    for index, engine in enumerate(engines):
+        yield from _iter_shard_csv(table, engine, header=index == 0)
+
+
+def _iter_shard_csv(table: str, engine, header: bool) -> Iterator[bytes]:
+    with engine.connect() as conn:
+        conn = _snapshot(conn)
+        with conn.begin():
+            result = conn.execute(text(f"SELECT * FROM {table} ORDER BY device_id, id"))
+            output = io.StringIO()
+            writer = csv.writer(output)
+            if header:
+                writer.writerow(result.keys())
+
+            for rows in result.partitions():
+                writer.writerows(rows)
+                if output.tell() >= EXPORT_CHUNK_BYTES:
+                    yield output.getvalue().encode("utf-8")
+                    output.seek(0)
+                    output.truncate()
+
+            if output.tell():
+                yield output.getvalue().encode("utf-8")
+
+
+def export_response(chunks: Iterable[bytes], media_type: str, filename: str, accept_encoding: str) -> StreamingResponse:
+    """StreamingResponse com gzip on-the-fly quando o cliente aceita"""
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Vary": "Accept-Encoding"
+    }
+    if "gzip" in accept_encoding.lower():
+        chunks = gzip_stream(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
@@ -0,0 +1,121 @@
+"""
+Validação rápida do JSON de ingestão direto para dicts
+Os modelos Pydantic de models.py continuam sendo a fonte da verdade: os
+TypedDicts usados aqui são gerados a partir deles, com os mesmos tipos,
+campos obrigatórios e mensagens de erro, mas sem instanciar um objeto por
+item para em seguida chamar model_dump().
+"""
+import copy
+from typing import Any, Dict, List, Tuple, Union, get_args, get_origin
+
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from pydantic.json_schema import models_json_schema
+from typing_extensions import NotRequired, Required, TypedDict
+
+from models import InventoryPayload
+
+_typed_dicts: Dict[type, type] = {}
+_defaults: Dict[type, List[Tuple[str, Any, Any]]] = {}
+
+
+def _nested_model(annotation) -> Any:
+    """Retorna o modelo de List[Modelo] / Optional[List[Modelo]], se houver"""
+    for arg in get_args(annotation) or ():
+        if isinstance(arg, type) and issubclass(arg, BaseModel):
+            return arg
+        nested = _nested_model(arg)
+        if nested is not None:
+            return nested
+    return None
+
+
+def _convert(annotation):
+    """Troca modelos Pydantic aninhados pelos TypedDicts equivalentes"""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return _typed_dict_for(annotation)
+    origin = get_origin(annotation)
+    if origin is None:
+        return annotation
+    args = tuple(_convert(arg) for arg in get_args(annotation))
+    if origin is Union:
+        return Union[args]
+    return origin[args]
+
+
+def _typed_dict_for(model: type) -> type:
+    """Gera (uma vez) o TypedDict e a tabela de defaults de um modelo"""
+    if model in _typed_dicts:
+        return _typed_dicts[model]
+
+    fields = {}
+    defaults = []
+    for name, field in model.model_fields.items():
+        annotation = _convert(field.annotation)
+        if field.is_required():
+            fields[name] = Required[annotation]
+        else:
+            fields[name] = NotRequired[annotation]
+            defaults.append((name, field.get_default(call_default_factory=True), None))
+        nested = _nested_model(field.annotation)
+        if nested is not None:
+            defaults.append((name, None, nested))
+
+    typed_dict = TypedDict(f"{model.__name__}Dict", fields, total=False)
+    _typed_dicts[model] = typed_dict
+    _defaults[model] = defaults
+    return typed_dict
+
+
+def _fill_defaults(data: dict, model: type) -> dict:
+    """Aplica os defaults do modelo (o que model_dump() devolveria)"""
+    for name, default, nested in _defaults[model]:
+        if nested is not None:
+            for item in data.get(name) or ():
+                _fill_defaults(item, nested)
+        elif name not in data:
+            # Defaults mutáveis ([] / {}) são copiados, como o Pydantic faz
+            data[name] = copy.copy(default) if isinstance(default, (list, dict)) else default
+    return data
+
+
+_inventory_adapter = TypeAdapter(_typed_dict_for(InventoryPayload))
+
+
+def parse_inventory_json(body: bytes) -> dict:
+    """
+    Decodifica e valida o corpo de /api/ingest no formato que store_inventory consome.
+    Erros viram RequestValidationError (422), como na validação padrão do FastAPI.
+    """
+    try:
+        data = _inventory_adapter.validate_json(body)
+    except ValidationError as e:
+        errors = []
+        for error in e.errors(include_url=False):
+            if error["type"] == "json_invalid":
+                error = {**error, "msg": "JSON decode error"}
+            errors.append({**error, "loc": ("body", *error["loc"])})
+        raise RequestValidationError(errors, body=body)
+    return _fill_defaults(data, InventoryPayload)
+
+
+def inventory_openapi_schemas() -> dict:
+    """Schemas de InventoryPayload (e aninhados) para components/schemas do OpenAPI"""
+    _, schema = models_json_schema(
+        [(InventoryPayload, "validation")],
+        ref_template="#/components/schemas/{model}"
+    )
+    return schema.get("$defs", {})
+
+
+# Documenta o corpo de /api/ingest mesmo sem o parâmetro Pydantic na rota
+INGEST_OPENAPI_EXTRA = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {
+                "schema": {"$ref": "#/components/schemas/InventoryPayload"}
+            }
+        }
+    }
+}
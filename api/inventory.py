@@ -0,0 +1,72 @@
+"""
+Normalização do inventário (dict do parser XML ou do JSON) em linhas das tabelas
+Compartilhado entre a ingestão online (store_inventory) e as ferramentas em lote.
+"""
+from typing import Dict, List, Optional
+
+# Colunas de devices preenchidas a partir do inventário
+DEVICE_COLUMNS = (
+    "device_id", "hostname", "ip_address", "mac_address", "os_name", "os_version",
+    "os_architecture", "manufacturer", "model", "serial_number", "cpu_name",
+    "cpu_cores", "ram_mb"
+)
+
+# Tabelas filhas: tabela -> (seção no inventário, campo obrigatório, colunas)
+CHILD_TABLES = {
+    "software": (
+        "software", "name",
+        ("device_id", "name", "version", "publisher", "install_date")
+    ),
+    "hardware_storage": (
+        "storage", "disk_name",
+        ("device_id", "disk_name", "disk_type", "capacity_gb", "serial_number")
+    ),
+    "network_interfaces": (
+        "network_interfaces", "interface_name",
+        ("device_id", "interface_name", "mac_address", "ip_address",
+         "netmask", "gateway", "dhcp_enabled", "status")
+    ),
+    "logged_users": (
+        "logged_users", "username",
+        ("device_id", "username", "domain")
+    ),
+}
+
+# Colunas INET: string vazia (comum no XML do agente) vira NULL
+INET_COLUMNS = {"ip_address", "gateway"}
+
+
+def clean_install_date(install_date: Optional[str]) -> Optional[str]:
+    """Trata datas vazias ou inválidas"""
+    if not install_date or install_date.strip() in ("", "0000-00-00", "N/A"):
+        return None
+    return install_date
+
+
+def _clean(column: str, value):
+    if column in INET_COLUMNS and value == "":
+        return None
+    if column == "install_date":
+        return clean_install_date(value)
+    return value
+
+
+def device_row(data: dict) -> dict:
+    """Linha de devices (sem last_seen/first_seen)"""
+    return {column: _clean(column, data.get(column)) for column in DEVICE_COLUMNS}
+
+
+def child_rows(data: dict) -> Dict[str, List[dict]]:
+    """Linhas de cada tabela filha; itens sem o campo obrigatório são ignorados"""
+    device_id = data["device_id"]
+    rows = {}
+    for table, (section, required, columns) in CHILD_TABLES.items():
+        rows[table] = [
+            {
+                column: device_id if column == "device_id" else _clean(column, item.get(column))
+                for column in columns
+            }
+            for item in data.get(section) or []
+            if item.get(required)
+        ]
+    return rows
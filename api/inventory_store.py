@@ -0,0 +1,148 @@
+"""
+Gravação online de um inventário (endpoints de ingestão e fallback do bulk_import)
+Sem dependências da API, para ser importado pelas ferramentas de linha de comando.
+"""
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from inventory import CHILD_TABLES, device_row, child_rows
+from device_cache import notify_sql
+from changes import TRACKED_DEVICE_COLUMNS, delete_children_sql, diff_inventory, record_changes
+from serialization import rows_to_dicts
+from sharding import shard_for
+
+logger = logging.getLogger(__name__)
+
+
+def _child_insert_sql(table: str) -> str:
+    """INSERT de uma tabela filha; duplicatas do mesmo inventário são ignoradas"""
+    columns = CHILD_TABLES[table][2]
+    return f"""
+        INSERT INTO {table} ({", ".join(columns)})
+        VALUES ({", ".join(":" + column for column in columns)})
+        ON CONFLICT DO NOTHING
+    """
+
+
+CHILD_INSERT_SQL = {table: _child_insert_sql(table) for table in CHILD_TABLES}
+
+
+def store_inventory(data: dict, db: Session, received_at: Optional[datetime] = None) -> str:
+    """
+    Armazena dados de inventário no banco de dados
+
+    Gravações do mesmo device_id são serializadas por um advisory lock de
+    transação; se um inventário mais novo já foi aplicado enquanto este
+    aguardava, apenas o payload bruto é guardado (last-writer-wins).
+    """
+    received_at = received_at or datetime.now(timezone.utc)
+    try:
+        # 0. Serializar gravações do mesmo dispositivo (liberado no commit/rollback)
+        db.execute(
+            text("SELECT pg_advisory_xact_lock(hashtext(:device_id))"),
+            {"device_id": data["device_id"]}
+        )
+
+        # 1. Armazenar payload bruto em raw_inventory
+        db.execute(
+            text("""
+                INSERT INTO raw_inventory (device_id, hostname, payload, received_at)
+                VALUES (:device_id, :hostname, :payload, :received_at)
+            """),
+            {
+                "device_id": data["device_id"],
+                "hostname": data["hostname"],
+                "payload": json.dumps(data),
+                "received_at": received_at
+            }
+        )
+
+        # Estado anterior: decide o last-writer-wins e alimenta o log de alterações
+        previous = db.execute(
+            text(f"""
+                SELECT last_seen > :received_at AS newer, {", ".join(TRACKED_DEVICE_COLUMNS)}
+                FROM devices WHERE device_id = :device_id
+            """),
+            {"device_id": data["device_id"], "received_at": received_at}
+        ).mappings().first()
+        if previous and previous["newer"]:
+            db.commit()
+            logger.info(f"Inventário obsoleto ignorado (versão mais nova já aplicada): {data['device_id']}")
+            return data["device_id"]
+        
+        # 2. Inserir ou atualizar na tabela devices
+        device = device_row(data)
+        db.execute(
+            text("""
+                INSERT INTO devices (
+                    device_id, hostname, ip_address, mac_address, os_name, os_version,
+                    os_architecture, manufacturer, model, serial_number, cpu_name,
+                    cpu_cores, ram_mb, last_seen, first_seen
+                ) VALUES (
+                    :device_id, :hostname, :ip_address, :mac_address, :os_name, :os_version,
+                    :os_architecture, :manufacturer, :model, :serial_number, :cpu_name,
+                    :cpu_cores, :ram_mb, :last_seen, :first_seen
+                )
+                ON CONFLICT (device_id) DO UPDATE SET
+                    hostname = EXCLUDED.hostname,
+                    ip_address = EXCLUDED.ip_address,
+                    mac_address = EXCLUDED.mac_address,
+                    os_name = EXCLUDED.os_name,
+                    os_version = EXCLUDED.os_version,
+                    os_architecture = EXCLUDED.os_architecture,
+                    manufacturer = EXCLUDED.manufacturer,
+                    model = EXCLUDED.model,
+                    serial_number = EXCLUDED.serial_number,
+                    cpu_name = EXCLUDED.cpu_name,
+                    cpu_cores = EXCLUDED.cpu_cores,
+                    ram_mb = EXCLUDED.ram_mb,
+                    last_seen = EXCLUDED.last_seen
+            """),
+            {
+                **device,
+                "last_seen": received_at,
+                "first_seen": received_at
+            }
+        )
+        
+        # 3. Limpar e inserir software, storage, network interfaces e logged users
+        children = child_rows(data)
+        old_children = {}
+        for table, rows in children.items():
+            deleted = db.execute(
+                text(delete_children_sql(table, "device_id = :device_id")),
+                {"device_id": data["device_id"]}
+            )
+            if deleted.returns_rows:
+                old_children[table] = rows_to_dicts(deleted)
+            if rows:
+                db.execute(text(CHILD_INSERT_SQL[table]), rows)
+        
+        # 4. Invalidar o cache de dispositivos dos workers (entregue no commit)
+        db.execute(text(notify_sql(":device_id")), {"device_id": data["device_id"]})
+
+        # 5. Log de alterações (/api/changes)
+        record_changes(db, diff_inventory(data["device_id"], previous, device, old_children, children))
+
+        db.commit()
+        logger.info(f"✓ Inventário armazenado: {data['device_id']}")
+        return data["device_id"]
+        
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Erro ao armazenar inventário: {e}")
+        raise
+
+
+def store_inventory_in_shard(data: dict, received_at: Optional[datetime] = None) -> str:
+    """store_inventory no shard dono do device_id"""
+    db = shard_for(data["device_id"]).session()
+    try:
+        return store_inventory(data, db, received_at)
+    finally:
+        db.close()
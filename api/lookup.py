@@ -0,0 +1,101 @@
+"""
+Busca de dispositivos por IP, sub-rede ou MAC
+Cobre o endereço principal (devices) e todas as interfaces (network_interfaces),
+usando os índices GiST inet_ops e de MAC normalizado de schema.sql.
+"""
+import os
+import ipaddress
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+from serialization import rows_to_dicts
+from sharding import scatter
+
+# Limite de resultados por consulta (o cliente pode pedir menos)
+LOOKUP_MAX_RESULTS = int(os.getenv("LOOKUP_MAX_RESULTS", "1000"))
+
+# Mesma expressão dos índices idx_*_mac_norm (precisa coincidir para o índice ser usado)
+MAC_NORMALIZED = "lower(regexp_replace({column}, '[^0-9A-Fa-f]', '', 'g'))"
+
+# Filtro por tipo de busca; {c} é a tabela (devices ou network_interfaces)
+_FILTERS = {
+    # && usa o índice; host() descarta redes que apenas contêm o endereço
+    "ip": "{c}.ip_address && CAST(:value AS inet) AND host({c}.ip_address) = host(CAST(:value AS inet))",
+    "subnet": "{c}.ip_address <<= CAST(:value AS inet)",
+    "mac": MAC_NORMALIZED.format(column="{c}.mac_address") + " = :value",
+}
+
+# Cada shard devolve os primeiros na mesma ordem do merge em lookup() (_ip_key:
+# família e endereço do host, sem a máscara; NULL e texto em ordem de código,
+# como no Python), para o corte pelo LIMIT ser o mesmo
+_LOOKUP_SQL = """
+    SELECT * FROM (
+        SELECT d.device_id, d.hostname, 'device' AS source, NULL AS interface_name,
+               d.ip_address, d.mac_address, d.last_seen
+        FROM devices d
+        WHERE {device_filter}
+        UNION ALL
+        SELECT n.device_id, d.hostname, 'interface' AS source, n.interface_name,
+               n.ip_address, n.mac_address, d.last_seen
+        FROM network_interfaces n
+        JOIN devices d ON d.device_id = n.device_id
+        WHERE {interface_filter}
+    ) matches
+    ORDER BY family(ip_address) NULLS FIRST,
+             set_masklen(ip_address, CASE family(ip_address) WHEN 4 THEN 32 ELSE 128 END),
+             device_id COLLATE "C", interface_name COLLATE "C" NULLS FIRST
+    LIMIT :limit
+"""
+
+LOOKUP_SQL = {
+    kind: text(_LOOKUP_SQL.format(
+        device_filter=condition.format(c="d"),
+        interface_filter=condition.format(c="n")
+    ))
+    for kind, condition in _FILTERS.items()
+}
+
+
+def parse_ip(value: str) -> str:
+    """Endereço IPv4/IPv6 único; ValueError se inválido"""
+    return str(ipaddress.ip_address(value.strip()))
+
+
+def parse_subnet(value: str) -> str:
+    """Sub-rede em notação CIDR (bits de host são ignorados); ValueError se inválida"""
+    return str(ipaddress.ip_network(value.strip(), strict=False))
+
+
+def normalize_mac(value: str) -> str:
+    """Aceita 00:1A:2B:3C:4D:5E, 00-1a-2b-3c-4d-5e, 001a.2b3c.4d5e, ..."""
+    digits = "".join(ch for ch in value if ch not in ":-. ").lower()
+    if len(digits) != 12 or any(ch not in "0123456789abcdef" for ch in digits):
+        raise ValueError(f"Invalid MAC address: {value}")
+    return digits
+
+
+def _ip_key(value: Optional[str]) -> Tuple[int, int]:
+    if not value:
+        return (0, 0)
+    address = ipaddress.ip_interface(value).ip
+    return (address.version, int(address))
+
+
+def lookup(kind: str, value: str, limit: int, last_write: Optional[float] = None) -> Tuple[List[dict], bool]:
+    """
+    Consulta todos os shards e devolve (resultados ordenados por IP, truncado?)
+    `value` já deve estar validado/normalizado (parse_ip, parse_subnet, normalize_mac).
+    """
+    params = {"value": value, "limit": limit + 1}
+
+    def fetch(shard):
+        db = shard.read_session(last_write)
+        try:
+            return rows_to_dicts(db.execute(LOOKUP_SQL[kind], params))
+        finally:
+            db.close()
+
+    matches = [row for rows in scatter(fetch) for row in rows]
+    matches.sort(key=lambda row: (_ip_key(row["ip_address"]), row["device_id"], row["interface_name"] or ""))
+    return matches[:limit], len(matches) > limit
@@ -3,17 +3,44 @@ API FastAPI para Ingestão de Dados OCS Inventory
 Compatível com agente OCS oficial (XML) e também aceita JSON
 """
 from fastapi import FastAPI, Request, Depends, HTTPException, status
-from fastapi.responses import Response, JSONResponse
+from fastapi.responses import Response, JSONResponse, FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.openapi.utils import get_openapi
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import List, Optional
-import xml.etree.ElementTree as ET
-import json
+import asyncio
+import heapq
+import itertools
+import os
+import time
 import logging
 
-from database import get_db, test_connection
-from models import InventoryPayload, DeviceResponse, IngestResponse, HealthResponse
+from database import (
+    get_read_db, test_connection, replica_monitor, recent_write, last_write_of, prewarm_pool,
+    LAST_WRITE_COOKIE, LAST_WRITE_HEADER, READ_YOUR_WRITES_WINDOW,
+    WEB_CONCURRENCY, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_PREWARM
+)
+from models import (
+    DeviceResponse, IngestResponse, HealthResponse, IngestStatsResponse, CacheStatsResponse, LookupMatch,
+    QueryRequest, QueryMatch, ChangesResponse
+)
+from admission import ingest_admission, AdmissionRejected, AdmissionSuperseded
+from serialization import FastJSONResponse, rows_to_dicts, to_json
+from fast_ingest import parse_inventory_json, inventory_openapi_schemas, INGEST_OPENAPI_EXTRA
+from export import EXPORT_TABLES, iter_devices_ndjson, iter_table_csv, export_response
+from device_cache import device_cache, invalidation_listeners, LIST_KEY
+from lookup import LOOKUP_MAX_RESULTS, lookup, parse_ip, parse_subnet, normalize_mac
+from query_dsl import QUERY_MAX_RESULTS, QueryError, QueryValueError, run_query
+from analytics_state import ANALYTICS_TABLES, load_state, table_path
+from changes import (
+    CHANGES_MAX_RESULTS, CHANGES_MAX_WAIT, CHANGES_POLL_INTERVAL, ChangesExpired,
+    change_signal, changes_pruner, decode_position, encode_position, head_position, read_changes
+)
+from ocs_xml import InvalidOcsXml, parse_ocs_xml, decompress_ocs_body
+from inventory_store import store_inventory_in_shard
+from sharding import shards, shard_for, scatter, get_device_read_db, encode_cursor, decode_cursor
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -29,6 +56,26 @@ app = FastAPI(
 )
 
 
+def custom_openapi():
+    """Schema OpenAPI padrão + modelos de entrada validados fora da assinatura das rotas"""
+    if app.openapi_schema:
+        return app.openapi_schema
+    openapi_schema = get_openapi(
+        title=app.title,
+        version=app.version,
+        description=app.description,
+        routes=app.routes
+    )
+    openapi_schema.setdefault("components", {}).setdefault("schemas", {}).update(
+        inventory_openapi_schemas()
+    )
+    app.openapi_schema = openapi_schema
+    return app.openapi_schema
+
+
+app.openapi = custom_openapi
+
+
 @app.on_event("startup")
 async def startup_event():
     """Evento executado no startup da aplicação"""
@@ -37,6 +84,37 @@ async def startup_event():
         logger.info("✓ Conexão com banco de dados OK")
     else:
         logger.error("✗ Falha na conexão com banco de dados")
+    logger.info(
+        f"Pool por banco neste worker: {DB_POOL_SIZE} + {DB_MAX_OVERFLOW} overflow "
+        f"({WEB_CONCURRENCY} workers)"
+    )
+    if DB_POOL_PREWARM:
+        engines = {id(e): e for shard in shards for e in (shard.engine, shard.read_engine)}
+        opened = await asyncio.gather(*(run_in_threadpool(prewarm_pool, e) for e in engines.values()))
+        logger.info(f"✓ Pools pré-aquecidos: {sum(opened)} conexões")
+    # Reload/encerramento: recusa novas ingestões assim que o sinal chega
+    ingest_admission.drain_on_signal()
+    if len(shards) > 1:
+        logger.info(f"Dados particionados em {len(shards)} shards: {', '.join(s.name for s in shards)}")
+    for listener in invalidation_listeners:
+        listener.start()
+    replica_monitor.start()
+    changes_pruner.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Evento executado no encerramento da aplicação"""
+    # Ingestões em andamento terminam antes de os pools serem fechados
+    if not await ingest_admission.drain():
+        logger.warning("Encerrando com ingestões ainda em andamento")
+    for listener in invalidation_listeners:
+        await listener.stop()
+    await replica_monitor.stop()
+    await changes_pruner.stop()
+    for shard in shards:
+        shard.engine.dispose()
+        shard.read_engine.dispose()
 
 
 @app.get("/", tags=["Health"])
@@ -50,7 +128,7 @@ async def root():
 
 
 @app.get("/health", response_model=HealthResponse, tags=["Health"])
-async def health_check(db: Session = Depends(get_db)):
+async def health_check(db: Session = Depends(get_read_db)):
     """Verifica saúde da API e conexão com banco"""
     try:
         db.execute(text("SELECT 1"))
@@ -63,272 +141,19 @@ async def health_check(db: Session = Depends(get_db)):
     return HealthResponse(
         status="healthy",
         database=db_status,
+        replica=replica_monitor.status(),
         timestamp=datetime.now()
     )
 
-#------------< início da função >------------------------------------        
-def parse_ocs_xml(xml_content: str) -> dict:
-    """
-    Parseia XML do agente OCS e converte para dicionário Python
-    """
-    def safe_int(value, default=0):
-        try:
-            if value is None:
-                return default
-            return int(float(value))
-        except Exception:
-            return default
-
-    try:
-        root = ET.fromstring(xml_content)
-
-        device_data = {
-            "device_id": None,
-            "hostname": None,
-            "ip_address": None,
-            "mac_address": None,
-            "os_name": None,
-            "os_version": None,
-            "os_architecture": None,
-            "manufacturer": None,
-            "model": None,
-            "serial_number": None,
-            "cpu_name": None,
-            "cpu_cores": None,
-            "ram_mb": None,
-            "software": [],
-            "storage": [],
-            "network_interfaces": [],
-            "logged_users": []
-        }
-
-#------------< início da correção >------------------------------------        
-        # HARDWARE section
-        hardware = root.find(".//HARDWARE")
-        if hardware is not None:
-            device_data["device_id"] = hardware.findtext("UUID") or hardware.findtext("NAME")
-            device_data["hostname"] = hardware.findtext("NAME")
-            device_data["ip_address"] = hardware.findtext("IPADDR")
-            device_data["os_name"] = hardware.findtext("OSNAME")
-            device_data["os_version"] = hardware.findtext("OSVERSION")
-            device_data["os_architecture"] = hardware.findtext("ARCH")
-            device_data["manufacturer"] = hardware.findtext("SMANUFACTURER") or hardware.findtext("MANUFACTURER")
-            device_data["model"] = hardware.findtext("SMODEL") or hardware.findtext("MODEL")
-            device_data["serial_number"] = hardware.findtext("SSN")
-            device_data["cpu_name"] = hardware.findtext("PROCESSORT")
-            device_data["cpu_cores"] = safe_int(hardware.findtext("PROCESSORN"))
-            device_data["ram_mb"] = safe_int(hardware.findtext("MEMORY"))
-
-        # STORAGES section
-        for storage in root.findall(".//STORAGES"):
-            device_data["storage"].append({
-                "disk_name": storage.findtext("NAME", ""),
-                "disk_type": storage.findtext("TYPE", ""),
-                # DISKSIZE costuma vir em MB (às vezes float). Convertemos para GB:
-                "capacity_gb": int(float(storage.findtext("DISKSIZE", "0")) / 1024),
-                "serial_number": storage.findtext("SERIALNUMBER", "")
-            })
-
-#------------< fim da correção >------------------------------------        
-        # NETWORKS section
-        for network in root.findall(".//NETWORKS"):
-            device_data["network_interfaces"].append({
-                "interface_name": network.findtext("DESCRIPTION", ""),
-                "mac_address": network.findtext("MACADDR", ""),
-                "ip_address": network.findtext("IPADDRESS", ""),
-                "netmask": network.findtext("IPMASK", ""),
-                "gateway": network.findtext("IPGATEWAY", ""),
-                "dhcp_enabled": network.findtext("IPDHCP") == "1",
-                "status": network.findtext("STATUS", "unknown")
-            })
-        
-        # SOFTWARES section
-        for software in root.findall(".//SOFTWARES"):
-            device_data["software"].append({
-                "name": software.findtext("NAME", ""),
-                "version": software.findtext("VERSION", ""),
-                "publisher": software.findtext("PUBLISHER", ""),
-                "install_date": software.findtext("INSTALLDATE", "")
-            })
-        
-        # USERS section
-        for user in root.findall(".//USERS"):
-            device_data["logged_users"].append({
-                "username": user.findtext("LOGIN", ""),
-                "domain": user.findtext("DOMAIN", "")
-            })
-        
-        # (demais seções permanecem como estavam)
-        return device_data
-
-    except ET.ParseError as e:
-        logger.error(f"Erro ao parsear XML: {e}")
-        raise HTTPException(status_code=400, detail=f"Invalid XML: {str(e)}")
-    except Exception as e:
-        logger.error(f"Erro inesperado ao processar XML: {e}")
-        raise HTTPException(status_code=500, detail=f"Error processing XML: {str(e)}")
-
-#------------< fim da função >------------------------------------        
-
-def store_inventory(data: dict, db: Session) -> str:
-    """
-    Armazena dados de inventário no banco de dados
-    """
-    try:
-        # 1. Armazenar payload bruto em raw_inventory
-        db.execute(
-            text("""
-                INSERT INTO raw_inventory (device_id, hostname, payload, received_at)
-                VALUES (:device_id, :hostname, :payload, :received_at)
-            """),
-            {
-                "device_id": data["device_id"],
-                "hostname": data["hostname"],
-                "payload": json.dumps(data),
-                "received_at": datetime.now()
-            }
-        )
-        
-        # 2. Inserir ou atualizar na tabela devices
-        db.execute(
-            text("""
-                INSERT INTO devices (
-                    device_id, hostname, ip_address, mac_address, os_name, os_version,
-                    os_architecture, manufacturer, model, serial_number, cpu_name,
-                    cpu_cores, ram_mb, last_seen, first_seen
-                ) VALUES (
-                    :device_id, :hostname, :ip_address, :mac_address, :os_name, :os_version,
-                    :os_architecture, :manufacturer, :model, :serial_number, :cpu_name,
-                    :cpu_cores, :ram_mb, :last_seen, :first_seen
-                )
-                ON CONFLICT (device_id) DO UPDATE SET
-                    hostname = EXCLUDED.hostname,
-                    ip_address = EXCLUDED.ip_address,
-                    mac_address = EXCLUDED.mac_address,
-                    os_name = EXCLUDED.os_name,
-                    os_version = EXCLUDED.os_version,
-                    os_architecture = EXCLUDED.os_architecture,
-                    manufacturer = EXCLUDED.manufacturer,
-                    model = EXCLUDED.model,
-                    serial_number = EXCLUDED.serial_number,
-                    cpu_name = EXCLUDED.cpu_name,
-                    cpu_cores = EXCLUDED.cpu_cores,
-                    ram_mb = EXCLUDED.ram_mb,
-                    last_seen = EXCLUDED.last_seen
-            """),
-            {
-                **data,
-                "last_seen": datetime.now(),
-                "first_seen": datetime.now()
-            }
-        )
-        
-        # 3. Limpar e inserir software
-        db.execute(
-            text("DELETE FROM software WHERE device_id = :device_id"),
-            {"device_id": data["device_id"]}
-        )
-        for sw in data.get("software", []):
-            if sw.get("name"):
-                install_date = sw.get("install_date")
-                # Trata datas vazias ou inválidas
-                if not install_date or install_date.strip() in ("", "0000-00-00", "N/A"):
-                    install_date = None
-
-                db.execute(
-                    text("""
-                        INSERT INTO software (device_id, name, version, publisher, install_date)
-                        VALUES (:device_id, :name, :version, :publisher, :install_date)
-                        ON CONFLICT (device_id, name, version) DO NOTHING
-                    """),
-                    {
-                        "device_id": data["device_id"],
-                        "name": sw.get("name"),
-                        "version": sw.get("version"),
-                        "publisher": sw.get("publisher"),
-                        "install_date": install_date
-                    }
-                )
-
-        
-        # 4. Limpar e inserir storage
-        db.execute(
-            text("DELETE FROM hardware_storage WHERE device_id = :device_id"),
-            {"device_id": data["device_id"]}
-        )
-        for storage in data.get("storage", []):
-            if storage.get("disk_name"):
-                db.execute(
-                    text("""
-                        INSERT INTO hardware_storage (device_id, disk_name, disk_type, capacity_gb, serial_number)
-                        VALUES (:device_id, :disk_name, :disk_type, :capacity_gb, :serial_number)
-                        ON CONFLICT (device_id, disk_name) DO NOTHING
-                    """),
-                    {
-                        "device_id": data["device_id"],
-                        **storage
-                    }
-                )
-        
-        # 5. Limpar e inserir network interfaces
-        db.execute(
-            text("DELETE FROM network_interfaces WHERE device_id = :device_id"),
-            {"device_id": data["device_id"]}
-        )
-        for net in data.get("network_interfaces", []):
-            if net.get("interface_name"):
-                db.execute(
-                    text("""
-                        INSERT INTO network_interfaces (
-                            device_id, interface_name, mac_address, ip_address,
-                            netmask, gateway, dhcp_enabled, status
-                        ) VALUES (
-                            :device_id, :interface_name, :mac_address, :ip_address,
-                            :netmask, :gateway, :dhcp_enabled, :status
-                        )
-                        ON CONFLICT (device_id, interface_name) DO NOTHING
-                    """),
-                    {
-                        "device_id": data["device_id"],
-                        **net
-                    }
-                )
-        
-        # 6. Limpar e inserir logged users
-        db.execute(
-            text("DELETE FROM logged_users WHERE device_id = :device_id"),
-            {"device_id": data["device_id"]}
-        )
-        for user in data.get("logged_users", []):
-            if user.get("username"):
-                db.execute(
-                    text("""
-                        INSERT INTO logged_users (device_id, username, domain)
-                        VALUES (:device_id, :username, :domain)
-                        ON CONFLICT (device_id, username) DO NOTHING
-                    """),
-                    {
-                        "device_id": data["device_id"],
-                        **user
-                    }
-                )
-        
-        db.commit()
-        logger.info(f"✓ Inventário armazenado: {data['device_id']}")
-        return data["device_id"]
-        
-    except Exception as e:
-        db.rollback()
-        logger.error(f"Erro ao armazenar inventário: {e}")
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 #----------< início da correção >----------------------------
 @app.post("/ocsinventory", tags=["OCS Agent"])
-async def ocs_inventory_endpoint(request: Request, db: Session = Depends(get_db)):
+async def ocs_inventory_endpoint(request: Request):
     """
     Endpoint compatível com agente OCS Inventory oficial
     Aceita XML no formato OCS (compactado ou não) e retorna resposta XML
     """
+    received_at = datetime.now(timezone.utc)
     try:
         # Ler corpo da requisição
         body = await request.body()
@@ -337,28 +162,8 @@ async def ocs_inventory_endpoint(request: Request, db: Session = Depends(get_db)
         logger.info(f"Recebida requisição OCS - Content-Type: {content_type}")
 
         # --- 🧠 NOVO BLOCO: lidar com compressão do agente ---
-        import gzip, zlib
-
         if "compress" in content_type:
-            original_body = body
-            # 1. Tenta descompactar com zlib (wbits=47) - para zlib e gzip com cabeçalhos
-            try:
-                body = zlib.decompress(body, wbits=47)
-                logger.info("XML descompactado com zlib (wbits=47 - zlib/gzip auto)")
-            except zlib.error as zlib_err_47:
-                # 2. Tenta descompactar com zlib (wbits=15) - para zlib padrão
-                try:
-                    body = zlib.decompress(original_body, wbits=15)
-                    logger.info("XML descompactado com zlib (wbits=15 - zlib padrão)")
-                except zlib.error as zlib_err_15:
-                    # 3. Tenta descompactar com gzip (gzip.decompress)
-                    try:
-                        body = gzip.decompress(original_body)
-                        logger.info("XML descompactado com gzip (gzip.decompress)")
-                    except Exception as gzip_err:
-                        # 4. Se falhar, mantém o corpo original e loga o erro
-                        body = original_body
-                        logger.warning(f"Falha ao descompactar XML. Erro zlib(47): {zlib_err_47}. Erro zlib(15): {zlib_err_15}. Erro gzip: {gzip_err}. Processando como não compactado.")
+            body = decompress_ocs_body(body)
 
         # Decode texto
         xml_content = body.decode("utf-8", errors="ignore").strip()
@@ -391,8 +196,11 @@ async def ocs_inventory_endpoint(request: Request, db: Session = Depends(get_db)
             return Response(content=response_xml, media_type="application/xml")
 
         # Caso normal: XML de inventário completo
+        # Com a fila cheia, recusa antes de pagar o parsing no event loop
+        ingest_admission.precheck()
         device_data = parse_ocs_xml(xml_content)
-        device_id = store_inventory(device_data, db)
+        async with ingest_admission.admit(device_data["device_id"]):
+            device_id = await run_in_threadpool(store_inventory_in_shard, device_data, received_at)
 
         # Retornar confirmação de recebimento do inventário
         response_xml = """<?xml version="1.0" encoding="UTF-8"?>
@@ -400,7 +208,28 @@ async def ocs_inventory_endpoint(request: Request, db: Session = Depends(get_db)
 
 #-----------< fim da correção >-----------------------        
         return Response(content=response_xml, media_type="application/xml")
-        
+
+    except AdmissionSuperseded:
+        # Um inventário mais novo do mesmo dispositivo já está na fila
+        logger.info("Inventário coalescido: versão mais nova do dispositivo pendente")
+        response_xml = """<?xml version="1.0" encoding="UTF-8"?>
+        <REPLY><INVENTORY_RESPONSE>OK</INVENTORY_RESPONSE></REPLY>"""
+        return Response(content=response_xml, media_type="application/xml")
+
+    except AdmissionRejected as e:
+        # Servidor saturado: agente deve tentar novamente no próximo ciclo
+        logger.warning(f"Ingestão OCS recusada: {e.reason}")
+        busy_xml = """<?xml version="1.0" encoding="UTF-8"?>
+<REPLY>
+    <RESPONSE>STOP</RESPONSE>
+</REPLY>"""
+        return Response(
+            content=busy_xml,
+            media_type="application/xml",
+            status_code=503,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
     except Exception as e:
         logger.error(f"Erro no endpoint OCS: {e}")
         error_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
@@ -408,21 +237,45 @@ async def ocs_inventory_endpoint(request: Request, db: Session = Depends(get_db)
     <RESPONSE>ERROR</RESPONSE>
     <ERROR>{str(e)}</ERROR>
 </REPLY>"""
-        # Se o erro for uma HTTPException (como a 400 de XML inválido), usa o status code dela
+        # HTTPException usa o próprio status code; XML inválido é 400
         if isinstance(e, HTTPException):
             status_code = e.status_code
+        elif isinstance(e, InvalidOcsXml):
+            status_code = 400
         else:
             status_code = 500
             
         return Response(content=error_xml, media_type="application/xml", status_code=status_code)
 
 
-@app.post("/api/ingest", response_model=IngestResponse, tags=["API"])
-async def ingest_json(payload: InventoryPayload, db: Session = Depends(get_db)):
+def _ingest_busy(e: AdmissionRejected) -> HTTPException:
+    logger.warning(f"Ingestão JSON recusada: {e.reason}")
+    return HTTPException(
+        status_code=503,
+        detail=f"Server busy: {e.reason}",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+
+@app.post("/api/ingest", response_model=IngestResponse, tags=["API"], openapi_extra=INGEST_OPENAPI_EXTRA)
+async def ingest_json(request: Request, response: Response):
     # Endpoint alternativo que aceita JSON (para testes e integrações customizadas)
+    # O corpo segue InventoryPayload, mas é validado direto para dicts (fast_ingest)
+    received_at = datetime.now(timezone.utc)
     try:
-        data = payload.model_dump()
-        device_id = store_inventory(data, db)
+        # Com a fila cheia, recusa antes de validar o corpo
+        ingest_admission.precheck()
+    except AdmissionRejected as e:
+        raise _ingest_busy(e)
+    data = parse_inventory_json(await request.body())
+    try:
+        async with ingest_admission.admit(data["device_id"]):
+            device_id = await run_in_threadpool(store_inventory_in_shard, data, received_at)
+
+        # Read-your-writes: leituras seguintes deste cliente vão para o primário
+        last_write = f"{time.time():.3f}"
+        response.headers[LAST_WRITE_HEADER] = last_write
+        response.set_cookie(LAST_WRITE_COOKIE, last_write, max_age=int(READ_YOUR_WRITES_WINDOW))
         
         return IngestResponse(
             status="success",
@@ -430,68 +283,166 @@ async def ingest_json(payload: InventoryPayload, db: Session = Depends(get_db)):
             device_id=device_id,
             timestamp=datetime.now()
         )
+    except AdmissionSuperseded:
+        return IngestResponse(
+            status="coalesced",
+            message="Superseded by a newer pending inventory for this device",
+            device_id=data["device_id"],
+            timestamp=datetime.now()
+        )
+    except AdmissionRejected as e:
+        raise _ingest_busy(e)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erro no ingest JSON: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/ingest/stats", response_model=IngestStatsResponse, tags=["API"])
+async def ingest_stats():
+    """Estado do controle de admissão (fila, recusas e coalescências)"""
+    return IngestStatsResponse(**ingest_admission.stats(), timestamp=datetime.now())
+
+
+@app.get("/api/cache/stats", response_model=CacheStatsResponse, tags=["API"])
+async def cache_stats():
+    """Taxa de acerto, memória e atraso de invalidação do cache deste worker"""
+    return CacheStatsResponse(**device_cache.stats(), timestamp=datetime.now())
+
+
+DEVICE_LIST_SQL = """
+    SELECT id, device_id, hostname, ip_address, os_name, os_version,
+           manufacturer, model, cpu_name, cpu_cores, ram_mb,
+           last_seen, first_seen
+    FROM devices
+    {where}
+    ORDER BY last_seen DESC, device_id COLLATE "C" DESC
+    LIMIT :fetch
+"""
+
+
 @app.get("/api/devices", response_model=List[DeviceResponse], tags=["API"])
 async def list_devices(
+    request: Request,
     limit: int = 100,
     offset: int = 0,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None
 ):
-    """Lista todos os dispositivos inventariados"""
+    """
+    Lista todos os dispositivos inventariados (mais recentes primeiro)
+
+    Para paginar, prefira `cursor` (devolvido no header X-Next-Cursor) a
+    `offset`: com vários shards, cada shard precisa ler offset + limit linhas.
+    """
+    cache_key = (LIST_KEY, limit, offset, cursor)
+    use_cache = not recent_write(request)
+    read_started = time.monotonic()
+    if use_cache:
+        cached = device_cache.get(cache_key)
+        if cached is not None:
+            return FastJSONResponse(cached[0], headers=cached[1])
+
+    params = {"fetch": offset + limit}
+    where = ""
+    if cursor:
+        try:
+            params["after_seen"], params["after_id"] = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        where = 'WHERE (last_seen, device_id COLLATE "C") < (:after_seen, :after_id)'
+    sql = text(DEVICE_LIST_SQL.format(where=where))
+    last_write = last_write_of(request)
+
+    def fetch(shard):
+        db = shard.read_session(last_write)
+        try:
+            return rows_to_dicts(db.execute(sql, params)), db.get_bind() is not shard.engine
+        finally:
+            db.close()
+
     try:
-        result = db.execute(
-            text("""
-                SELECT id, device_id, hostname, ip_address, os_name, os_version,
-                       manufacturer, model, cpu_name, cpu_cores, ram_mb,
-                       last_seen, first_seen
-                FROM devices
-                ORDER BY last_seen DESC
-                LIMIT :limit OFFSET :offset
-            """),
-            {"limit": limit, "offset": offset}
+        # Scatter-gather: cada shard devolve sua página já ordenada; o merge
+        # mantém a mesma ordem (last_seen, device_id) usada pelo cursor
+        results = await run_in_threadpool(scatter, fetch)
+        merged = heapq.merge(
+            *(rows for rows, _ in results),
+            key=lambda row: (row["last_seen"], row["device_id"].encode("utf-8")),
+            reverse=True
         )
+        page = list(itertools.islice(merged, offset, offset + limit))
+
+        headers = None
+        if page and len(page) == limit:
+            headers = {"X-Next-Cursor": encode_cursor(page[-1]["last_seen"], page[-1]["device_id"])}
+
+        content = to_json(page)
+        if use_cache:
+            from_replica = any(replica for _, replica in results)
+            device_cache.put(cache_key, LIST_KEY, content, read_started, from_replica=from_replica, headers=headers)
+        return FastJSONResponse(content, headers=headers)
         
-        devices = []
-        for row in result:
-            devices.append(DeviceResponse(
-                id=row.id,
-                device_id=row.device_id,
-                hostname=row.hostname,
-                ip_address=str(row.ip_address) if row.ip_address else None,
-                os_name=row.os_name,
-                os_version=row.os_version,
-                manufacturer=row.manufacturer,
-                model=row.model,
-                cpu_name=row.cpu_name,
-                cpu_cores=row.cpu_cores,
-                ram_mb=row.ram_mb,
-                last_seen=row.last_seen,
-                first_seen=row.first_seen
-            ))
-        
-        return devices
-        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erro ao listar dispositivos: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _find_device_elsewhere(device_id: str, last_write: Optional[float]):
+    """
+    Procura o dispositivo nos outros shards: durante um rebalanceamento
+    (rebalance.py) ele ainda pode estar no shard antigo
+    """
+    owner = shard_for(device_id)
+
+    def lookup(shard):
+        db = shard.read_session(last_write)
+        found = db.execute(
+            text("SELECT 1 FROM devices WHERE device_id = :device_id"),
+            {"device_id": device_id}
+        ).first()
+        if found is None:
+            db.close()
+            return None
+        return db
+
+    others = [shard for shard in shards if shard is not owner]
+    if not others:
+        return None
+    sessions = [db for db in scatter(lookup, others) if db is not None]
+    for db in sessions[1:]:
+        db.close()
+    return sessions[0] if sessions else None
+
+
 @app.get("/api/devices/{device_id}", tags=["API"])
-async def get_device_details(device_id: str, db: Session = Depends(get_db)):
+async def get_device_details(device_id: str, request: Request, db: Session = Depends(get_device_read_db)):
     """Obtém detalhes completos de um dispositivo"""
+    use_cache = not recent_write(request)
+    read_started = time.monotonic()
+    if use_cache:
+        cached = device_cache.get(device_id)
+        if cached is not None:
+            return FastJSONResponse(cached[0])
+
+    fallback = None
     try:
         # Buscar device
         device = db.execute(
             text("SELECT * FROM devices WHERE device_id = :device_id"),
             {"device_id": device_id}
         ).fetchone()
-        
+
         if not device:
-            raise HTTPException(status_code=404, detail="Device not found")
+            fallback = await run_in_threadpool(_find_device_elsewhere, device_id, last_write_of(request))
+            if fallback is None:
+                raise HTTPException(status_code=404, detail="Device not found")
+            db = fallback
+            device = db.execute(
+                text("SELECT * FROM devices WHERE device_id = :device_id"),
+                {"device_id": device_id}
+            ).fetchone()
         
         # Buscar software
         software = db.execute(
@@ -511,18 +462,173 @@ async def get_device_details(device_id: str, db: Session = Depends(get_db)):
             {"device_id": device_id}
         ).fetchall()
         
-        return {
+        content = to_json({
             "device": dict(device._mapping),
             "software": [dict(s._mapping) for s in software],
             "storage": [dict(s._mapping) for s in storage],
             "network_interfaces": [dict(n._mapping) for n in network]
-        }
+        }, utc_z=False)
+        # Resultado vindo de um shard que não é o dono não é cacheado
+        if use_cache and fallback is None:
+            from_replica = db.get_bind() is not shard_for(device_id).engine
+            device_cache.put(device_id, device_id, content, read_started, from_replica=from_replica)
+        return FastJSONResponse(content)
         
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Erro ao buscar dispositivo: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if fallback is not None:
+            fallback.close()
+
+
+async def _lookup_response(request: Request, kind: str, value: str, limit: int) -> FastJSONResponse:
+    """Executa a busca em todos os shards; X-Truncated indica que havia mais resultados"""
+    limit = max(1, min(limit, LOOKUP_MAX_RESULTS))
+    try:
+        matches, truncated = await run_in_threadpool(lookup, kind, value, limit, last_write_of(request))
+    except Exception as e:
+        logger.error(f"Erro na busca por {kind}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return FastJSONResponse(to_json(matches), headers={"X-Truncated": "true"} if truncated else None)
+
+
+@app.get("/api/lookup/ip", response_model=List[LookupMatch], tags=["Lookup"])
+async def lookup_ip(request: Request, ip: str, limit: int = 100):
+    """Dispositivos que têm (ou tiveram no último inventário) o IP, em qualquer interface"""
+    try:
+        value = parse_ip(ip)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid IP address: {ip}")
+    return await _lookup_response(request, "ip", value, limit)
+
+
+@app.get("/api/lookup/subnet", response_model=List[LookupMatch], tags=["Lookup"])
+async def lookup_subnet(request: Request, cidr: str, limit: int = 100):
+    """Dispositivos com algum endereço dentro da sub-rede (ex.: 10.4.0.0/16)"""
+    try:
+        value = parse_subnet(cidr)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid subnet: {cidr}")
+    return await _lookup_response(request, "subnet", value, limit)
+
+
+@app.get("/api/lookup/mac", response_model=List[LookupMatch], tags=["Lookup"])
+async def lookup_mac(request: Request, mac: str, limit: int = 100):
+    """Dispositivos com o MAC (qualquer formato: 00:1A:2B:..., 00-1a-2b-..., 001a.2b3c...)"""
+    try:
+        value = normalize_mac(mac)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid MAC address: {mac}")
+    return await _lookup_response(request, "mac", value, limit)
+
+
+@app.post("/api/query", response_model=List[QueryMatch], tags=["Lookup"])
+async def query_inventory(query: QueryRequest, request: Request):
+    """
+    Filtra dispositivos por qualquer atributo do último inventário recebido
+    (inclusive seções que não viram colunas), usando o índice GIN do payload
+    """
+    limit = max(1, min(query.limit, QUERY_MAX_RESULTS))
+    try:
+        matches = await run_in_threadpool(
+            run_query, query.filter, limit, query.after, query.include_payload, last_write_of(request)
+        )
+    except QueryValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Erro na consulta: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    headers = {"X-Next-Cursor": matches[-1]["device_id"]} if len(matches) == limit else None
+    return FastJSONResponse(to_json(matches), headers=headers)
+
+
+@app.get("/api/changes", response_model=ChangesResponse, tags=["Changes"])
+async def list_changes(request: Request, since: Optional[str] = None, limit: int = 500, wait: float = 0):
+    """
+    Alterações de inventário após o cursor `since` (omitido: desde o início do
+    log; `now`: só devolve o cursor atual). Com `wait`, aguarda até esse número
+    de segundos por novas alterações antes de responder vazio (long-polling).
+    Continue sempre do `cursor` devolvido.
+    """
+    limit = max(1, min(limit, CHANGES_MAX_RESULTS))
+    wait = max(0.0, min(wait, CHANGES_MAX_WAIT))
+    try:
+        positions = decode_position(None if since == "now" else since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {since}")
+
+    deadline = time.monotonic() + wait
+    try:
+        if since == "now":
+            positions = await run_in_threadpool(head_position)
+            return FastJSONResponse(to_json({"changes": [], "cursor": encode_position(positions), "has_more": False}))
+        while True:
+            # Armado antes da leitura: um commit durante a consulta ainda acorda a espera
+            wakeup = change_signal.arm()
+            page = await run_in_threadpool(read_changes, positions, limit)
+            remaining = deadline - time.monotonic()
+            if page["changes"] or remaining <= 0 or await request.is_disconnected():
+                return FastJSONResponse(to_json(page))
+            await change_signal.wait(wakeup, min(remaining, CHANGES_POLL_INTERVAL))
+    except ChangesExpired as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except Exception as e:
+        logger.error(f"Erro ao ler alterações: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/export/devices.ndjson", tags=["Export"])
+async def export_devices(request: Request):
+    """
+    Exporta todo o parque em uma única resposta (NDJSON, um dispositivo por linha,
+    com software/storage/network_interfaces/logged_users aninhados)
+    """
+    return export_response(
+        iter_devices_ndjson([shard.reader(last_write_of(request)) for shard in shards]),
+        media_type="application/x-ndjson",
+        filename="devices.ndjson",
+        accept_encoding=request.headers.get("accept-encoding", "")
+    )
+
+
+@app.get("/api/export/{table}.csv", tags=["Export"])
+async def export_table_csv(table: str, request: Request):
+    """Exporta uma tabela normalizada completa em CSV"""
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown table. Available: {', '.join(EXPORT_TABLES)}")
+
+    return export_response(
+        iter_table_csv(table, [shard.reader(last_write_of(request)) for shard in shards]),
+        media_type="text/csv",
+        filename=f"{table}.csv",
+        accept_encoding=request.headers.get("accept-encoding", "")
+    )
+
+
+@app.get("/api/analytics/status", tags=["Analytics"])
+async def analytics_status():
+    """Último snapshot Parquet: data, marcas d'água por shard e linhas por tabela"""
+    state = load_state()
+    if not state.get("generated_at"):
+        raise HTTPException(status_code=404, detail="No analytics snapshot yet (run analytics_snapshot.py)")
+    return state
+
+
+@app.get("/api/analytics/{table}.parquet", tags=["Analytics"])
+async def analytics_file(table: str):
+    """Arquivo Parquet de uma tabela, para ferramentas de BI (DuckDB, pandas, Power BI, ...)"""
+    if table not in ANALYTICS_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown table. Available: {', '.join(ANALYTICS_TABLES)}")
+    path = table_path(table)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="No analytics snapshot yet (run analytics_snapshot.py)")
+    return FileResponse(path, media_type="application/vnd.apache.parquet", filename=f"{table}.parquet")
 
 
 if __name__ == "__main__":
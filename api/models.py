@@ -125,5 +125,89 @@ class IngestResponse(BaseModel):
 class HealthResponse(BaseModel):
     status: str
     database: str
+    replica: Optional[str] = None
     timestamp: datetime
 
+
+
+class IngestStatsResponse(BaseModel):
+    max_concurrent: int
+    max_queue: int
+    in_flight: int
+    queue_depth: int
+    admitted: int
+    rejected: int
+    coalesced: int
+    draining: bool = False
+    timestamp: datetime
+
+
+class CacheStatsResponse(BaseModel):
+    enabled: bool
+    listener_connected: bool
+    entries: int
+    max_entries: int
+    memory_bytes: int
+    max_bytes: int
+    hits: int
+    misses: int
+    hit_rate: float
+    evictions: int
+    invalidations: int
+    notifications: int
+    notification_bursts: int
+    invalidation_lag_avg_ms: float
+    invalidation_lag_max_ms: float
+    timestamp: datetime
+
+
+class LookupMatch(BaseModel):
+    """Dispositivo encontrado por IP/sub-rede/MAC (endereço principal ou de uma interface)"""
+    device_id: str
+    hostname: Optional[str] = None
+    source: str = Field(..., description="'device' (endereço principal) ou 'interface'")
+    interface_name: Optional[str] = None
+    ip_address: Optional[str] = None
+    mac_address: Optional[str] = None
+    last_seen: datetime
+
+
+class QueryRequest(BaseModel):
+    """Consulta sobre o último payload bruto de cada dispositivo (ver query_dsl.py)"""
+    filter: Dict[str, Any] = Field(
+        ...,
+        description="Condições {field, equals|contains|exists} combinadas com and/or/not",
+        examples=[{"and": [
+            {"field": "os_name", "equals": "Windows 11"},
+            {"field": "software.name", "contains": "chrome"}
+        ]}]
+    )
+    limit: int = 100
+    after: Optional[str] = Field(None, description="Paginação: device_id do último resultado anterior")
+    include_payload: bool = False
+
+
+class QueryMatch(BaseModel):
+    device_id: str
+    hostname: Optional[str] = None
+    received_at: datetime
+    payload: Optional[Dict[str, Any]] = None
+
+
+class ChangeEntry(BaseModel):
+    """Alteração no log de um shard; (shard, seq) identifica a entrada"""
+    shard: str
+    seq: int
+    device_id: str
+    change_type: str = Field(
+        ...,
+        description="device_added, software_installed, software_removed, software_updated, hardware_changed ou os_changed"
+    )
+    detail: Optional[Dict[str, Any]] = None
+    changed_at: datetime
+
+
+class ChangesResponse(BaseModel):
+    changes: List[ChangeEntry]
+    cursor: str = Field(..., description="Valor de `since` para a próxima chamada")
+    has_more: bool = Field(..., description="Há mais alterações disponíveis sem esperar")
@@ -0,0 +1,144 @@
+"""
+XML do agente OCS: descompressão do corpo e conversão para o dicionário de inventário
+Sem dependências da API: usado pelo endpoint /ocsinventory (main.py) e pelos
+processos do importador em lote (bulk_import.py).
+"""
+import xml.etree.ElementTree as ET
+import gzip
+import zlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidOcsXml(ValueError):
+    """XML malformado (o endpoint responde 400)"""
+
+
+#------------< início da função >------------------------------------        
+def parse_ocs_xml(xml_content: str) -> dict:
+    """
+    Parseia XML do agente OCS e converte para dicionário Python
+    """
+    def safe_int(value, default=0):
+        try:
+            if value is None:
+                return default
+            return int(float(value))
+        except Exception:
+            return default
+
+    try:
+        root = ET.fromstring(xml_content)
+
+        device_data = {
+            "device_id": None,
+            "hostname": None,
+            "ip_address": None,
+            "mac_address": None,
+            "os_name": None,
+            "os_version": None,
+            "os_architecture": None,
+            "manufacturer": None,
+            "model": None,
+            "serial_number": None,
+            "cpu_name": None,
+            "cpu_cores": None,
+            "ram_mb": None,
+            "software": [],
+            "storage": [],
+            "network_interfaces": [],
+            "logged_users": []
+        }
+
+#------------< início da correção >------------------------------------        
+        # HARDWARE section
+        hardware = root.find(".//HARDWARE")
+        if hardware is not None:
+            device_data["device_id"] = hardware.findtext("UUID") or hardware.findtext("NAME")
+            device_data["hostname"] = hardware.findtext("NAME")
+            device_data["ip_address"] = hardware.findtext("IPADDR")
+            device_data["os_name"] = hardware.findtext("OSNAME")
+            device_data["os_version"] = hardware.findtext("OSVERSION")
+            device_data["os_architecture"] = hardware.findtext("ARCH")
+            device_data["manufacturer"] = hardware.findtext("SMANUFACTURER") or hardware.findtext("MANUFACTURER")
+            device_data["model"] = hardware.findtext("SMODEL") or hardware.findtext("MODEL")
+            device_data["serial_number"] = hardware.findtext("SSN")
+            device_data["cpu_name"] = hardware.findtext("PROCESSORT")
+            device_data["cpu_cores"] = safe_int(hardware.findtext("PROCESSORN"))
+            device_data["ram_mb"] = safe_int(hardware.findtext("MEMORY"))
+
+        # STORAGES section
+        for storage in root.findall(".//STORAGES"):
+            device_data["storage"].append({
+                "disk_name": storage.findtext("NAME", ""),
+                "disk_type": storage.findtext("TYPE", ""),
+                # DISKSIZE costuma vir em MB (às vezes float). Convertemos para GB:
+                "capacity_gb": int(float(storage.findtext("DISKSIZE", "0")) / 1024),
+                "serial_number": storage.findtext("SERIALNUMBER", "")
+            })
+
+#------------< fim da correção >------------------------------------        
+        # NETWORKS section
+        for network in root.findall(".//NETWORKS"):
+            device_data["network_interfaces"].append({
+                "interface_name": network.findtext("DESCRIPTION", ""),
+                "mac_address": network.findtext("MACADDR", ""),
+                "ip_address": network.findtext("IPADDRESS", ""),
+                "netmask": network.findtext("IPMASK", ""),
+                "gateway": network.findtext("IPGATEWAY", ""),
+                "dhcp_enabled": network.findtext("IPDHCP") == "1",
+                "status": network.findtext("STATUS", "unknown")
+            })
+        
+        # SOFTWARES section
+        for software in root.findall(".//SOFTWARES"):
+            device_data["software"].append({
+                "name": software.findtext("NAME", ""),
+                "version": software.findtext("VERSION", ""),
+                "publisher": software.findtext("PUBLISHER", ""),
+                "install_date": software.findtext("INSTALLDATE", "")
+            })
+        
+        # USERS section
+        for user in root.findall(".//USERS"):
+            device_data["logged_users"].append({
+                "username": user.findtext("LOGIN", ""),
+                "domain": user.findtext("DOMAIN", "")
+            })
+        
+        # (demais seções permanecem como estavam)
+        return device_data
+
+    except ET.ParseError as e:
+        logger.error(f"Erro ao parsear XML: {e}")
+        raise InvalidOcsXml(f"Invalid XML: {str(e)}") from e
+
+#------------< fim da função >------------------------------------        
+
+def decompress_ocs_body(body: bytes) -> bytes:
+    """
+    Descompacta o corpo enviado pelo agente OCS (zlib ou gzip).
+    Se nenhuma tentativa funcionar, devolve o corpo original.
+    """
+    original_body = body
+    # 1. Tenta descompactar com zlib (wbits=47) - para zlib e gzip com cabeçalhos
+    try:
+        body = zlib.decompress(body, wbits=47)
+        logger.info("XML descompactado com zlib (wbits=47 - zlib/gzip auto)")
+    except zlib.error as zlib_err_47:
+        # 2. Tenta descompactar com zlib (wbits=15) - para zlib padrão
+        try:
+            body = zlib.decompress(original_body, wbits=15)
+            logger.info("XML descompactado com zlib (wbits=15 - zlib padrão)")
+        except zlib.error as zlib_err_15:
+            # 3. Tenta descompactar com gzip (gzip.decompress)
+            try:
+                body = gzip.decompress(original_body)
+                logger.info("XML descompactado com gzip (gzip.decompress)")
+            except Exception as gzip_err:
+                # 4. Se falhar, mantém o corpo original e loga o erro
+                body = original_body
+                logger.warning(f"Falha ao descompactar XML. Erro zlib(47): {zlib_err_47}. Erro zlib(15): {zlib_err_15}. Erro gzip: {gzip_err}. Processando como não compactado.")
+    return body
+
@@ -0,0 +1,222 @@
+"""
+Linguagem de filtros sobre o payload bruto (raw_inventory.payload)
+Permite consultar qualquer atributo do inventário, inclusive os que não viram
+colunas normalizadas. Os filtros são compilados para operadores jsonpath
+(@@ / @?) que o índice GIN idx_raw_inventory_payload atende, e apenas o
+payload mais recente de cada dispositivo é considerado.
+
+Filtro (JSON):
+    {"field": "os_name", "equals": "Windows 11"}
+    {"field": "software.name", "contains": "chrome"}      (substring, sem distinção de caixa)
+    {"field": "metadata.bios", "exists": true}
+    {"and": [...]}, {"or": [...]}, {"not": {...}}
+
+Campos são caminhos separados por ponto; listas (software, storage, ...) são
+percorridas automaticamente. Toda consulta precisa de ao menos uma condição
+equals/exists (não negada) para usar o índice; consultas que o planner estima
+ler mais de QUERY_MAX_SELECTIVITY de raw_inventory (onde o índice não ajuda e
+o plano vira sequential scan) são recusadas.
+"""
+import os
+import re
+import json
+import math
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from serialization import rows_to_dicts
+from sharding import scatter
+
+# Resultados por página (o cliente pode pedir menos)
+QUERY_MAX_RESULTS = int(os.getenv("QUERY_MAX_RESULTS", "1000"))
+# Tempo máximo de cada consulta em cada shard (ms)
+QUERY_TIMEOUT_MS = int(os.getenv("QUERY_TIMEOUT_MS", "5000"))
+# Fração máxima de raw_inventory que o planner pode estimar ler para a consulta
+QUERY_MAX_SELECTIVITY = float(os.getenv("QUERY_MAX_SELECTIVITY", "0.2"))
+# Abaixo deste número de linhas em raw_inventory qualquer filtro é aceito
+QUERY_SELECTIVITY_MIN_ROWS = int(os.getenv("QUERY_SELECTIVITY_MIN_ROWS", "10000"))
+# Tamanho máximo do filtro (condições + combinadores) e profundidade
+QUERY_MAX_NODES = 32
+QUERY_MAX_DEPTH = 8
+
+_SEGMENT = re.compile(r"^[A-Za-z0-9_]+$")
+_REGEX_SPECIAL = re.compile(r"([.^$*+?()\[\]{}|\\])")
+_SCALARS = (str, int, float, bool, type(None))
+
+
+class QueryError(ValueError):
+    """Filtro inválido (vira 400)"""
+
+
+class QueryRejected(QueryError):
+    """Filtro válido, mas pouco seletivo: leria boa parte de raw_inventory"""
+
+
+class QueryValueError(QueryError):
+    """Valor sem representação em jsonpath, ex.: NaN/Infinity (vira 422)"""
+
+
+def _jsonpath(field: Any) -> str:
+    if not isinstance(field, str) or not field:
+        raise QueryError("'field' must be a non-empty string")
+    segments = field.split(".")
+    for segment in segments:
+        if not _SEGMENT.match(segment):
+            raise QueryError(f"Invalid field: {field} (use letters, digits and _ separated by '.')")
+    return "$" + "".join(f'."{segment}"' for segment in segments)
+
+
+class _Compiler:
+    """
+    Gera a expressão SQL do filtro e, em paralelo, uma condição implicada por
+    ele que usa apenas operadores indexáveis (None quando não existe)
+    """
+
+    def __init__(self):
+        self.params: dict = {}
+        self.nodes = 0
+
+    def _param(self, jsonpath: str) -> str:
+        name = f"p{len(self.params)}"
+        self.params[name] = jsonpath
+        return f"CAST(:{name} AS jsonpath)"
+
+    def compile(self, node: Any, depth: int = 0) -> Tuple[str, Optional[str]]:
+        self.nodes += 1
+        if self.nodes > QUERY_MAX_NODES:
+            raise QueryError(f"Filter too large (max {QUERY_MAX_NODES} conditions)")
+        if depth > QUERY_MAX_DEPTH:
+            raise QueryError(f"Filter too deep (max {QUERY_MAX_DEPTH} levels)")
+        if not isinstance(node, dict) or not node:
+            raise QueryError("Each filter node must be a non-empty object")
+
+        if "and" in node or "or" in node:
+            operator = "and" if "and" in node else "or"
+            children = node[operator]
+            if len(node) != 1 or not isinstance(children, list) or not children:
+                raise QueryError(f"'{operator}' must be the only key and hold a non-empty list")
+            compiled = [self.compile(child, depth + 1) for child in children]
+            sql = "(" + f" {operator.upper()} ".join(child_sql for child_sql, _ in compiled) + ")"
+            indexed = [index for _, index in compiled if index is not None]
+            if operator == "and":
+                # Basta um ramo indexável para restringir os candidatos
+                index = "(" + " AND ".join(indexed) + ")" if indexed else None
+            else:
+                # OR só é indexável se todos os ramos forem
+                index = "(" + " OR ".join(indexed) + ")" if len(indexed) == len(compiled) else None
+            return sql, index
+
+        if "not" in node:
+            if len(node) != 1:
+                raise QueryError("'not' must be the only key")
+            child_sql, _ = self.compile(node["not"], depth + 1)
+            return f"NOT {child_sql}", None
+
+        return self._leaf(node)
+
+    def _leaf(self, node: dict) -> Tuple[str, Optional[str]]:
+        tests = [key for key in ("equals", "contains", "exists") if key in node]
+        if set(node) != {"field", *tests} or len(tests) != 1:
+            raise QueryError("A condition needs 'field' and exactly one of 'equals', 'contains', 'exists'")
+        path = _jsonpath(node["field"])
+        test, value = tests[0], node[tests[0]]
+
+        if test == "equals":
+            if not isinstance(value, _SCALARS):
+                raise QueryError("'equals' takes a string, number, boolean or null")
+            if isinstance(value, float) and not math.isfinite(value):
+                raise QueryValueError("'equals' does not accept NaN or Infinity")
+            sql = f"(r.payload @@ {self._param(f'{path} == {json.dumps(value)}')})"
+            return sql, sql
+
+        if test == "exists":
+            if not isinstance(value, bool):
+                raise QueryError("'exists' takes true or false")
+            sql = f"(r.payload @? {self._param(path)})"
+            return (sql, sql) if value else (f"NOT {sql}", None)
+
+        if not isinstance(value, str) or not value:
+            raise QueryError("'contains' takes a non-empty string")
+        pattern = json.dumps(_REGEX_SPECIAL.sub(r"\\\1", value))
+        jsonpath = f'{path} ? (@ like_regex {pattern} flag "i")'
+        # Substring não é indexável: só serve como verificação dos candidatos
+        return f"(r.payload @? {self._param(jsonpath)})", None
+
+
+def compile_filter(node: Any) -> Tuple[str, dict]:
+    """Filtro -> (condição SQL sobre raw_inventory r, parâmetros)"""
+    compiler = _Compiler()
+    sql, index = compiler.compile(node)
+    if index is None:
+        raise QueryRejected(
+            "Filter needs at least one non-negated 'equals' or 'exists' condition "
+            "('contains' and 'not' alone cannot use the index)"
+        )
+    # A condição indexável repetida no nível de cima garante que o planner a enxergue
+    where = sql if index == sql else f"{index} AND {sql}"
+    return where, compiler.params
+
+
+def build_query_sql(where: str, include_payload: bool, after: Optional[str]) -> str:
+    return f"""
+        SELECT r.device_id, r.hostname, r.received_at{", r.payload" if include_payload else ""}
+        FROM raw_inventory r
+        WHERE {where}
+          {'AND r.device_id COLLATE "C" > :after' if after else ""}
+          AND NOT EXISTS (
+              SELECT 1 FROM raw_inventory newer
+              WHERE newer.device_id = r.device_id AND newer.received_at > r.received_at
+          )
+        ORDER BY r.device_id COLLATE "C"
+        LIMIT :limit
+    """
+
+
+def _estimated_rows(plan: dict, alias: str) -> Optional[float]:
+    """Linhas estimadas pelo nó que lê `alias` em um plano EXPLAIN (FORMAT JSON)"""
+    if plan.get("Relation Name") == "raw_inventory" and plan.get("Alias") == alias:
+        return float(plan.get("Plan Rows", 0))
+    for child in plan.get("Plans", []):
+        rows = _estimated_rows(child, alias)
+        if rows is not None:
+            return rows
+    return None
+
+
+def run_query(node: Any, limit: int, after: Optional[str] = None, include_payload: bool = False,
+              last_write: Optional[float] = None) -> List[dict]:
+    """Executa o filtro em todos os shards; resultados ordenados por device_id"""
+    where, params = compile_filter(node)
+    sql = build_query_sql(where, include_payload, after)
+    params = {**params, "limit": limit}
+    if after:
+        params["after"] = after
+
+    def fetch(shard):
+        db = shard.read_session(last_write)
+        try:
+            db.execute(text("SELECT set_config('statement_timeout', :value, true)"), {"value": str(QUERY_TIMEOUT_MS)})
+            # compile_filter já garante um caminho pelo índice; o que decide é quanto
+            # da tabela o filtro casa (ex.: "hostname exists" casa tudo). Tabelas
+            # pequenas são baratas de qualquer jeito
+            total = db.execute(text(
+                "SELECT reltuples FROM pg_class WHERE oid = 'raw_inventory'::regclass"
+            )).scalar() or 0
+            if total >= QUERY_SELECTIVITY_MIN_ROWS:
+                plan = db.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                estimated = _estimated_rows(plan[0]["Plan"], "r")
+                if estimated is None or estimated > total * QUERY_MAX_SELECTIVITY:
+                    raise QueryRejected(
+                        f"Filter is not selective enough: it would read about {estimated or total:.0f} "
+                        f"of {total:.0f} inventory payloads"
+                    )
+            return rows_to_dicts(db.execute(text(sql), params))
+        finally:
+            db.close()
+
+    matches = [row for rows in scatter(fetch) for row in rows]
+    matches.sort(key=lambda row: row["device_id"].encode("utf-8"))
+    return matches[:limit]
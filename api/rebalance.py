@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Rebalanceamento de dispositivos entre shards
+Depois de adicionar um shard em SHARD_DATABASE_URLS, os dispositivos cujo
+dono mudou no anel de hashing consistente continuam no shard antigo. Este
+script percorre cada shard e move esses dispositivos (devices, tabelas filhas
+e o histórico em raw_inventory) para o novo dono.
+
+- Ordem de implantação: primeiro a API passa a usar a nova lista de shards
+  (ingestões novas já vão para o novo dono), depois roda-se o rebalanceamento.
+  Enquanto isso, /api/devices/{id} procura nos outros shards o que ainda não foi movido
+- Cada lote é copiado para o destino com last-writer-wins (se o destino já
+  recebeu um inventário mais novo, só o histórico é copiado) e removido da
+  origem na mesma transação de origem; repetir a execução é seguro
+- O histórico (raw_inventory) é copiado em blocos de REBALANCE_RAW_CHUNK_ROWS
+  payloads; devices e tabelas filhas vão em um único json_agg por lote
+- Para retirar um shard: tire-o de SHARD_DATABASE_URLS e informe-o em --drain
+- O log de alterações (device_changes) não é copiado nem gera eventos:
+  mudar de shard não é uma alteração do inventário
+
+Uso: python3 rebalance.py [--dry-run] [--batch-size N] [--drain NOME=URL,...]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+from collections import Counter
+from typing import Dict, Iterator, List
+
+from sqlalchemy import text
+
+from inventory import CHILD_TABLES
+from device_cache import notify_sql
+from sharding import Shard, shards, shard_for, parse_shard_urls
+
+logger = logging.getLogger("rebalance")
+
+# devices antes das filhas (FK); raw_inventory não depende de devices e é
+# copiada à parte, em blocos (o histórico de payloads pode ser grande)
+MOVED_TABLES = ("devices",) + tuple(CHILD_TABLES)
+# Linhas de raw_inventory por bloco copiado
+RAW_CHUNK_ROWS = int(os.getenv("REBALANCE_RAW_CHUNK_ROWS", "100"))
+# Colunas de devices que não são sobrescritas no destino
+DEVICE_KEEP_COLUMNS = {"device_id", "first_seen", "created_at"}
+
+_IDS = "CAST(:ids AS varchar[])"
+
+
+def iter_misplaced(shard: Shard, batch_size: int) -> Iterator[List[str]]:
+    """Keyset em device_id: dispositivos deste shard que pertencem a outro"""
+    after = ""
+    while True:
+        with shard.engine.connect() as conn:
+            device_ids = conn.execute(
+                text("""
+                    SELECT device_id FROM devices
+                    WHERE device_id > :after
+                    ORDER BY device_id
+                    LIMIT :limit
+                """),
+                {"after": after, "limit": batch_size}
+            ).scalars().all()
+        if not device_ids:
+            return
+        misplaced = [device_id for device_id in device_ids if shard_for(device_id) is not shard]
+        if misplaced:
+            yield misplaced
+        after = device_ids[-1]
+
+
+def _columns(conn, table: str) -> List[str]:
+    """Colunas da tabela, sem o id serial (cada shard tem a sua sequência)"""
+    return conn.execute(
+        text("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = :table AND column_name <> 'id'
+            ORDER BY ordinal_position
+        """),
+        {"table": table}
+    ).scalars().all()
+
+
+def _lock(conn, device_ids: List[str]) -> None:
+    """Mesmo advisory lock de store_inventory, em ordem fixa"""
+    conn.execute(text(f"""
+        SELECT pg_advisory_xact_lock(lock_key)
+        FROM (SELECT hashtext(device_id) AS lock_key FROM unnest({_IDS}) AS device_id ORDER BY 1) keys
+    """), {"ids": device_ids})
+
+
+def _insert_sql(table: str, columns: List[str], conflict: str) -> str:
+    names = ", ".join(columns)
+    return f"""
+        INSERT INTO {table} ({names})
+        SELECT {names} FROM json_populate_recordset(NULL::{table}, CAST(:rows AS json))
+        WHERE device_id = ANY({_IDS})
+        {conflict}
+    """
+
+
+def _device_upsert_sql(columns: List[str]) -> str:
+    updates = ",\n            ".join(
+        [f"{column} = EXCLUDED.{column}" for column in columns if column not in DEVICE_KEEP_COLUMNS]
+        + ["first_seen = LEAST(devices.first_seen, EXCLUDED.first_seen)"]
+    )
+    return "WITH applied AS (" + _insert_sql("devices", columns, f"""
+        ON CONFLICT (device_id) DO UPDATE SET
+            {updates}
+        WHERE devices.last_seen < EXCLUDED.last_seen
+        RETURNING device_id
+    """) + ") SELECT device_id FROM applied"
+
+
+def _copy_raw_inventory(src, dst, device_ids: List[str], columns: List[str]) -> int:
+    """Keyset em id: no máximo RAW_CHUNK_ROWS payloads em memória por vez"""
+    copied = 0
+    after_id = 0
+    while True:
+        last_id, rows = src.execute(
+            text(f"""
+                SELECT max(id), COALESCE(json_agg(t), '[]')::text
+                FROM (
+                    SELECT * FROM raw_inventory
+                    WHERE device_id = ANY({_IDS}) AND id > :after_id
+                    ORDER BY id
+                    LIMIT :limit
+                ) t
+            """),
+            {"ids": device_ids, "after_id": after_id, "limit": RAW_CHUNK_ROWS}
+        ).one()
+        if last_id is None:
+            return copied
+        copied += dst.execute(
+            text(_insert_sql("raw_inventory", columns, "ON CONFLICT (device_id, received_at) DO NOTHING")),
+            {"rows": rows, "ids": device_ids}
+        ).rowcount
+        after_id = last_id
+
+
+def move_batch(source: Shard, target: Shard, device_ids: List[str]) -> Dict[str, int]:
+    """Copia os dispositivos para o shard dono e os remove da origem"""
+    moved = Counter()
+    with source.engine.begin() as src:
+        # Segura gravações na origem (de APIs ainda com a configuração antiga)
+        # até o fim da cópia; o que chegar depois volta a aparecer no próximo rebalanceamento
+        _lock(src, device_ids)
+        rows = {
+            table: src.execute(
+                text(f"SELECT COALESCE(json_agg(t), '[]')::text FROM {table} t WHERE device_id = ANY({_IDS})"),
+                {"ids": device_ids}
+            ).scalar()
+            for table in MOVED_TABLES
+        }
+
+        with target.engine.begin() as dst:
+            _lock(dst, device_ids)
+            columns = {table: _columns(dst, table) for table in MOVED_TABLES + ("raw_inventory",)}
+
+            moved["raw_inventory"] = _copy_raw_inventory(src, dst, device_ids, columns["raw_inventory"])
+
+            # Dispositivos que já receberam inventário mais novo no destino ficam como estão
+            applied = dst.execute(
+                text(_device_upsert_sql(columns["devices"])),
+                {"rows": rows["devices"], "ids": device_ids}
+            ).scalars().all()
+            moved["devices"] = len(applied)
+
+            for table in CHILD_TABLES:
+                dst.execute(text(f"DELETE FROM {table} WHERE device_id = ANY({_IDS})"), {"ids": applied})
+                moved[table] = dst.execute(
+                    text(_insert_sql(table, columns[table], "ON CONFLICT DO NOTHING")),
+                    {"rows": rows[table], "ids": applied}
+                ).rowcount
+
+            dst.execute(text(f"{notify_sql('device_id')} FROM unnest({_IDS}) AS device_id"), {"ids": applied})
+
+        # Tabelas filhas saem junto (ON DELETE CASCADE)
+        src.execute(text(f"DELETE FROM raw_inventory WHERE device_id = ANY({_IDS})"), {"ids": device_ids})
+        src.execute(text(f"DELETE FROM devices WHERE device_id = ANY({_IDS})"), {"ids": device_ids})
+        src.execute(text(f"{notify_sql('device_id')} FROM unnest({_IDS}) AS device_id"), {"ids": device_ids})
+
+    return moved
+
+
+def run_rebalance(sources: List[Shard], batch_size: int, dry_run: bool) -> Counter:
+    stats = Counter()
+    start = time.perf_counter()
+    for source in sources:
+        for device_ids in iter_misplaced(source, batch_size):
+            by_target: Dict[Shard, List[str]] = {}
+            for device_id in device_ids:
+                by_target.setdefault(shard_for(device_id), []).append(device_id)
+
+            for target, target_ids in by_target.items():
+                stats[f"{source.name} -> {target.name}"] += len(target_ids)
+                if dry_run:
+                    continue
+                try:
+                    stats.update(move_batch(source, target, target_ids))
+                except Exception as e:
+                    stats["failed"] += len(target_ids)
+                    logger.error(f"Falha ao mover {len(target_ids)} dispositivos {source.name} -> {target.name}: {e}")
+
+            elapsed = max(time.perf_counter() - start, 1e-9)
+            print(
+                f"Progresso ({source.name}): {stats['devices']} dispositivos movidos, "
+                f"{stats['raw_inventory']} payloads, {stats['failed']} falhas | "
+                f"{stats['devices'] / elapsed:.1f} dispositivos/s",
+                flush=True
+            )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move dispositivos para o shard dono após mudar SHARD_DATABASE_URLS")
+    parser.add_argument("--dry-run", action="store_true", help="Apenas conta o que seria movido")
+    parser.add_argument("--batch-size", type=int, default=200, help="Dispositivos lidos por consulta (padrão: 200)")
+    parser.add_argument("--drain", default="", help="Shards retirados do anel a esvaziar (NOME=URL, separados por vírgula)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    # Shards retirados não são donos de nada: todo o conteúdo sai deles
+    drained = [Shard(name, url) for name, url in parse_shard_urls(args.drain)]
+    stats = run_rebalance(list(shards) + drained, args.batch_size, args.dry_run)
+
+    for route, count in sorted(stats.items()):
+        if "->" in route:
+            print(f"{route}: {count} dispositivos{' (simulação)' if args.dry_run else ''}")
+    sys.exit(1 if stats["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Serialização JSON rápida (orjson) para os endpoints de consulta
+"""
+from decimal import Decimal
+from typing import Any, List
+
+import orjson
+from fastapi.responses import Response
+
+
+def _default(value: Any) -> Any:
+    """Tipos que o orjson não serializa nativamente (INET, Decimal, ...)"""
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def to_json(content: Any, utc_z: bool = True) -> bytes:
+    """
+    Serializa dicts/listas direto para bytes, sem jsonable_encoder
+    utc_z=True mantém o formato de datas do Pydantic ("...Z" para UTC), usado
+    pelas rotas com response_model; utc_z=False mantém o do jsonable_encoder
+    ("...+00:00"), usado pelas rotas que devolviam dicts.
+    """
+    return orjson.dumps(content, default=_default, option=orjson.OPT_UTC_Z if utc_z else None)
+
+
+def rows_to_dicts(result) -> List[dict]:
+    """Converte um Result do SQLAlchemy em dicts sem passar por modelos Pydantic"""
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+
+def result_to_json(result) -> bytes:
+    """Serializa todas as linhas de um Result como um array JSON"""
+    return to_json(rows_to_dicts(result))
+
+
+class FastJSONResponse(Response):
+    """
+    Resposta JSON já serializada pelo orjson.
+    Retornar uma Response direto faz o FastAPI pular a revalidação do
+    response_model, que continua servindo apenas para o schema OpenAPI.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return to_json(content)
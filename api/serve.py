@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Entrada de produção da API: N processos uvicorn com orçamento de conexões
+
+- Cada worker recebe WEB_CONCURRENCY e dimensiona seus pools para que a soma
+  de todos os workers caiba em DB_CONNECTION_BUDGET por banco (database.py);
+  o padrão (número de CPUs) é limitado ao que o orçamento comporta e um número
+  explícito acima disso é recusado
+- Os pools são pré-aquecidos no startup de cada worker (DB_POOL_PREWARM)
+- Reload sem perder ingestões: `kill -HUP <pid>` reinicia os workers um a um;
+  cada worker para de admitir ingestões, conclui as em andamento (até
+  INGEST_DRAIN_TIMEOUT segundos) e só então fecha os pools
+- Com pgbouncer em modo transaction: DB_POOLER=pgbouncer e DIRECT_DATABASE_URL
+  (conexão direta, para o LISTEN do cache de dispositivos)
+
+Uso: python3 serve.py [--workers N] [--host HOST] [--port PORTA] [--reload]
+"""
+import os
+import sys
+import argparse
+
+import uvicorn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de produção da OCS Inventory API")
+    parser.add_argument("--workers", type=int, default=os.getenv("WEB_CONCURRENCY"),
+                        help="Processos da API (padrão: WEB_CONCURRENCY ou número de CPUs, "
+                             "limitado por DB_CONNECTION_BUDGET)")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--reload", action="store_true",
+                        help="Desenvolvimento: um único worker, reiniciado a cada alteração no código")
+    args = parser.parse_args()
+
+    try:
+        from database import DB_CONNECTION_BUDGET, DB_MAX_WORKERS, ConnectionBudgetError, pool_sizes
+    except RuntimeError as e:
+        # ConnectionBudgetError: WEB_CONCURRENCY do ambiente já acima do orçamento
+        parser.error(str(e))
+
+    if args.reload:
+        workers = 1
+    elif args.workers is not None:
+        workers = max(1, int(args.workers))
+    else:
+        workers = min(os.cpu_count() or 1, DB_MAX_WORKERS)
+        if (os.cpu_count() or 1) > workers:
+            print(f"{os.cpu_count()} CPUs, mas DB_CONNECTION_BUDGET={DB_CONNECTION_BUDGET} "
+                  f"comporta {workers} worker(s)", flush=True)
+    try:
+        pool_size, max_overflow = pool_sizes(workers)
+    except ConnectionBudgetError as e:
+        parser.error(str(e))
+    # Lido por database.py em cada worker (o import acontece nos processos filhos)
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+
+    from admission import INGEST_DRAIN_TIMEOUT
+
+    print(
+        f"Iniciando {workers} worker(s) em {args.host}:{args.port} | orçamento de {DB_CONNECTION_BUDGET} "
+        f"conexões por banco: LISTEN + pool {pool_size} + {max_overflow} overflow por worker",
+        flush=True
+    )
+    # Terminar de responder leva até o drain das ingestões; uvicorn aguarda um pouco além
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        reload=args.reload,
+        timeout_keep_alive=60,
+        timeout_graceful_shutdown=int(INGEST_DRAIN_TIMEOUT) + 5,
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
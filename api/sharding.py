@@ -0,0 +1,169 @@
+"""
+Particionamento (sharding) dos dados de dispositivos entre vários PostgreSQL
+Cada device_id pertence a um shard, escolhido por hashing consistente sobre o
+nome dos shards: adicionar um shard move apenas ~1/N dos dispositivos.
+
+Configuração: SHARD_DATABASE_URLS="shard0=postgresql://...,shard1=postgresql://..."
+(o nome é opcional; sem ele os shards se chamam shard0, shard1, ... na ordem).
+Sem SHARD_DATABASE_URLS há um único shard: DATABASE_URL (com a réplica de leitura).
+"""
+import os
+import json
+import base64
+import bisect
+import hashlib
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+from fastapi import Request
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import (
+    DATABASE_URL, engine, read_engine, SessionLocal, ReadSessionLocal,
+    use_replica, last_write_of, engine_options, listen_url
+)
+
+SHARD_DATABASE_URLS = os.getenv("SHARD_DATABASE_URLS", "")
+# Pontos virtuais por shard no anel (mais pontos = distribuição mais uniforme)
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "128"))
+
+T = TypeVar("T")
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Anel de hashing consistente: device_id -> nome do shard"""
+
+    def __init__(self, names: List[str], vnodes: int = SHARD_VNODES):
+        points = sorted((_hash(f"{name}#{i}"), name) for name in names for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    def owner(self, key: str) -> str:
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._names[index]
+
+
+class Shard:
+    """Um banco PostgreSQL com o schema completo e parte dos dispositivos"""
+
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = url
+        self.listen_url = listen_url(url)
+        if url == DATABASE_URL:
+            # O banco principal reaproveita o pool e a réplica de leitura de database.py
+            self.engine = engine
+            self.read_engine = read_engine
+            self.SessionLocal = SessionLocal
+            self.ReadSessionLocal = ReadSessionLocal
+        else:
+            self.engine = create_engine(url, **engine_options(url))
+            self.read_engine = self.engine
+            self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+            self.ReadSessionLocal = self.SessionLocal
+
+    @property
+    def replicated(self) -> bool:
+        return self.read_engine is not self.engine
+
+    def session(self):
+        """Sessão no primário do shard (gravações)"""
+        return self.SessionLocal()
+
+    def read_session(self, last_write: Optional[float] = None):
+        """Sessão de leitura: réplica quando houver e estiver saudável"""
+        if self.replicated and use_replica(last_write):
+            return self.ReadSessionLocal()
+        return self.SessionLocal()
+
+    def reader(self, last_write: Optional[float] = None):
+        """Engine de leitura, para consultas fora de sessões (streaming)"""
+        if self.replicated and use_replica(last_write):
+            return self.read_engine
+        return self.engine
+
+    def __repr__(self) -> str:
+        return f"Shard({self.name})"
+
+
+def parse_shard_urls(value: str) -> List[tuple]:
+    """'nome=url,url,...' -> [(nome, url), ...]"""
+    shards = []
+    for index, entry in enumerate(part.strip() for part in value.split(",")):
+        if not entry:
+            continue
+        name, separator, url = entry.partition("=")
+        if not separator or "://" in name:
+            name, url = f"shard{index}", entry
+        shards.append((name.strip(), url.strip()))
+    return shards
+
+
+def build_shards(value: str) -> List[Shard]:
+    configured = parse_shard_urls(value)
+    if not configured:
+        return [Shard("default", DATABASE_URL)]
+    return [Shard(name, url) for name, url in configured]
+
+
+shards: List[Shard] = build_shards(SHARD_DATABASE_URLS)
+shards_by_name = {shard.name: shard for shard in shards}
+ring = HashRing([shard.name for shard in shards])
+
+
+def shard_for(device_id: str) -> Shard:
+    """Shard dono do dispositivo"""
+    if len(shards) == 1:
+        return shards[0]
+    return shards_by_name[ring.owner(device_id)]
+
+
+def group_by_shard(items: List[T], device_id_of: Callable[[T], str]) -> Dict[Shard, List[T]]:
+    """Separa itens pelo shard dono (mantendo a ordem dentro de cada shard)"""
+    groups: Dict[Shard, List[T]] = {}
+    for item in items:
+        groups.setdefault(shard_for(device_id_of(item)), []).append(item)
+    return groups
+
+
+def scatter(func: Callable[[Shard], T], targets: Optional[List[Shard]] = None) -> List[T]:
+    """Executa func em todos os shards em paralelo (ordem dos resultados = ordem dos shards)"""
+    targets = targets if targets is not None else shards
+    if len(targets) == 1:
+        return [func(targets[0])]
+    with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+        return list(pool.map(func, targets))
+
+
+def get_device_read_db(device_id: str, request: Request):
+    """
+    Dependency: sessão de leitura no shard dono do device_id
+    Uso: db: Session = Depends(get_device_read_db)
+    """
+    db = shard_for(device_id).read_session(last_write_of(request))
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def encode_cursor(last_seen: datetime, device_id: str) -> str:
+    """Cursor opaco de paginação keyset (last_seen, device_id), igual em todos os shards"""
+    raw = json.dumps([last_seen.isoformat(), device_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Inverso de encode_cursor; ValueError se o cursor for inválido"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        last_seen, device_id = json.loads(raw)
+        return datetime.fromisoformat(last_seen), str(device_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
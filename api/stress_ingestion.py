@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Teste de estresse de concorrência da ingestão
+Dispara submissões simultâneas para /api/ingest e compara os cenários:
+  1. dispositivos distintos (sem contenção)
+  2. o mesmo dispositivo repetido (retry do agente + ingestão manual)
+  3. poucos dispositivos intercalados
+
+Na API, duplicatas pendentes do mesmo dispositivo são respondidas como
+"coalesced" pela admissão, sem chegar ao banco; por isso os cenários 4 e 5 chamam
+store_inventory_in_shard direto, em paralelo, para dispositivos distintos
+(referência) e para o mesmo device_id; o colapso de vazão é medido entre os
+dois (precisa das mesmas variáveis de conexão do banco que a API).
+
+Uso: python3 stress_ingestion.py [URL_API] [REQUISICOES] [THREADS]
+"""
+import sys
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+API_URL = "http://localhost:8000"
+
+
+def build_payload(device_id: str, seq: int) -> dict:
+    """Monta um inventário sintético com listas de tamanho realista"""
+    return {
+        "device_id": device_id,
+        "hostname": f"stress-{device_id}",
+        "ip_address": "10.0.0.1",
+        "os_name": "Linux",
+        "os_version": f"build-{seq}",
+        "cpu_cores": 4,
+        "ram_mb": 8192,
+        "software": [
+            {"name": f"package-{i}", "version": f"1.{i}.{seq}", "publisher": "Stress"}
+            for i in range(200)
+        ],
+        "storage": [{"disk_name": "/dev/sda", "disk_type": "SSD", "capacity_gb": 256}],
+        "network_interfaces": [{"interface_name": "eth0", "ip_address": "10.0.0.1"}],
+        "logged_users": [{"username": "stress", "domain": "LAB"}]
+    }
+
+
+def send(session: requests.Session, url: str, payload: dict) -> tuple:
+    """(status HTTP, status da resposta ou mensagem de erro)"""
+    try:
+        response = session.post(f"{url}/api/ingest", json=payload, timeout=60)
+        if response.status_code == 200:
+            return 200, response.json().get("status", "")
+        return response.status_code, response.text
+    except (requests.exceptions.RequestException, ValueError) as e:
+        return 0, str(e)
+
+
+def store_direct(store, payload: dict) -> tuple:
+    """Grava pelo mesmo caminho da API, sem a admissão (sem coalescência)"""
+    try:
+        store(payload, datetime.now(timezone.utc))
+        return 200, "success"
+    except Exception as e:
+        return 500, str(getattr(e, "detail", None) or e)
+
+
+def summarize(name: str, results: list, elapsed: float) -> dict:
+    summary = {
+        "name": name,
+        "total": len(results),
+        "ok": sum(1 for code, body in results if code == 200 and body != "coalesced"),
+        "coalesced": sum(1 for code, body in results if code == 200 and body == "coalesced"),
+        "busy": sum(1 for code, _ in results if code == 503),
+        "deadlocks": sum(1 for _, body in results if "deadlock" in body.lower()),
+        "errors": sum(1 for code, _ in results if code not in (200, 503)),
+        "elapsed": elapsed,
+        "rate": len(results) / elapsed if elapsed else 0.0
+    }
+    print(f"{name:<22} total={summary['total']:<5} ok={summary['ok']:<5} "
+          f"coalesced={summary['coalesced']:<5} busy={summary['busy']:<4} "
+          f"erros={summary['errors']:<4} deadlocks={summary['deadlocks']:<3} {summary['rate']:.1f} req/s")
+    return summary
+
+
+def run_scenario(url: str, name: str, device_ids: list, threads: int) -> dict:
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=threads)
+    session.mount("http://", adapter)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(
+            lambda item: send(session, url, build_payload(item[1], item[0])),
+            enumerate(device_ids)
+        ))
+    return summarize(name, results, time.perf_counter() - start)
+
+
+def run_direct_scenario(name: str, device_ids: list, threads: int) -> dict:
+    from inventory_store import store_inventory_in_shard
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(
+            lambda item: store_direct(store_inventory_in_shard, build_payload(item[1], item[0])),
+            enumerate(device_ids)
+        ))
+    return summarize(name, results, time.perf_counter() - start)
+
+
+def main():
+    url = sys.argv[1] if len(sys.argv) > 1 else API_URL
+    total = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+
+    print(f"Estresse de ingestão em {url} ({total} requisições, {threads} threads)\n")
+    distinct = run_scenario(url, "dispositivos distintos", [f"STRESS-{i}" for i in range(total)], threads)
+    duplicate = run_scenario(url, "mesmo dispositivo", ["STRESS-DUP"] * total, threads)
+    mixed = run_scenario(url, "4 dispositivos", [f"STRESS-MIX-{i % 4}" for i in range(total)], threads)
+    direct_distinct = run_direct_scenario(
+        "distintos (direto)", [f"STRESS-DIRECT-{i}" for i in range(total)], threads
+    )
+    direct = run_direct_scenario("mesmo disp. (direto)", ["STRESS-DIRECT"] * total, threads)
+
+    failures = []
+    for summary in (distinct, duplicate, mixed, direct_distinct, direct):
+        if summary["deadlocks"]:
+            failures.append(f"{summary['name']}: {summary['deadlocks']} deadlocks")
+        if summary["errors"]:
+            failures.append(f"{summary['name']}: {summary['errors']} erros")
+
+    # Duplicatas são serializadas pelo advisory lock, mas não podem derrubar a vazão.
+    # Comparado sem a admissão: pela API as duplicatas são coalescidas e saem baratas
+    if direct_distinct["rate"] and direct["rate"] < direct_distinct["rate"] * 0.25:
+        failures.append(
+            f"colapso de vazão: {direct['rate']:.1f} gravações/s vs {direct_distinct['rate']:.1f} gravações/s"
+        )
+
+    if failures:
+        print("\n✗ FALHA:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("\n✓ SUCESSO: sem deadlocks e sem colapso de vazão sob submissões duplicadas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+"""
+Os módulos da API são importados pelo nome (python3 main.py roda de dentro de api/)
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,132 @@
+"""
+Compilação dos filtros de /api/query (sem banco: só o SQL, os parâmetros gerados
+e a leitura dos planos EXPLAIN)
+"""
+import pytest
+
+from query_dsl import (
+    QUERY_MAX_DEPTH, QUERY_MAX_NODES, QueryError, QueryRejected, QueryValueError, compile_filter,
+    _estimated_rows
+)
+
+
+def test_equals_uses_indexable_jsonpath_match():
+    where, params = compile_filter({"field": "os_name", "equals": "Windows 11"})
+    assert where == "(r.payload @@ CAST(:p0 AS jsonpath))"
+    assert params == {"p0": '$."os_name" == "Windows 11"'}
+
+
+@pytest.mark.parametrize("value, literal", [(42, "42"), (1.5, "1.5"), (True, "true"), (None, "null")])
+def test_equals_scalars(value, literal):
+    _, params = compile_filter({"field": "ram_mb", "equals": value})
+    assert params["p0"] == f'$."ram_mb" == {literal}'
+
+
+def test_exists_and_nested_field():
+    where, params = compile_filter({"field": "metadata.bios", "exists": True})
+    assert where == "(r.payload @? CAST(:p0 AS jsonpath))"
+    assert params == {"p0": '$."metadata"."bios"'}
+
+
+def test_and_keeps_indexable_branch_in_front():
+    where, params = compile_filter({"and": [
+        {"field": "os_name", "equals": "Ubuntu"},
+        {"field": "software.name", "contains": "chrome"},
+    ]})
+    assert where.startswith("((r.payload @@ CAST(:p0 AS jsonpath))) AND (")
+    assert params["p1"] == '$."software"."name" ? (@ like_regex "chrome" flag "i")'
+
+
+def test_or_and_not():
+    where, _ = compile_filter({"or": [
+        {"field": "os_name", "equals": "Ubuntu"},
+        {"field": "os_name", "equals": "Debian"},
+    ]})
+    assert " OR " in where
+
+    where, _ = compile_filter({"and": [
+        {"field": "os_name", "equals": "Ubuntu"},
+        {"not": {"field": "hostname", "equals": "db01"}},
+    ]})
+    assert "NOT (r.payload @@ CAST(:p1 AS jsonpath))" in where
+
+
+def test_strings_are_quoted_and_escaped():
+    _, params = compile_filter({"field": "hostname", "equals": 'a"b\\c'})
+    assert params["p0"] == '$."hostname" == "a\\"b\\\\c"'
+
+
+def test_contains_escapes_regex_metacharacters():
+    _, params = compile_filter({"and": [
+        {"field": "os_name", "exists": True},
+        {"field": "software.name", "contains": "c++ (x64)"},
+    ]})
+    assert params["p1"] == '$."software"."name" ? (@ like_regex "c\\\\+\\\\+ \\\\(x64\\\\)" flag "i")'
+
+
+@pytest.mark.parametrize("field", ["", "os name", "a..b", "a.b'c", "$.x", 3])
+def test_invalid_fields(field):
+    with pytest.raises(QueryError):
+        compile_filter({"field": field, "equals": "x"})
+
+
+@pytest.mark.parametrize("node", [
+    {"field": "software.name", "contains": "chrome"},
+    {"not": {"field": "os_name", "equals": "Ubuntu"}},
+    {"field": "metadata.bios", "exists": False},
+    {"or": [{"field": "os_name", "equals": "Ubuntu"}, {"field": "hostname", "contains": "db"}]},
+])
+def test_non_indexable_filters_are_rejected(node):
+    with pytest.raises(QueryRejected):
+        compile_filter(node)
+
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), float("-inf")])
+def test_non_finite_numbers_are_rejected(value):
+    with pytest.raises(QueryValueError):
+        compile_filter({"field": "ram_mb", "equals": value})
+
+
+@pytest.mark.parametrize("node", [
+    {},
+    {"field": "os_name"},
+    {"field": "os_name", "equals": "x", "exists": True},
+    {"field": "os_name", "equals": ["x"]},
+    {"field": "os_name", "exists": "yes"},
+    {"field": "os_name", "contains": ""},
+    {"and": []},
+    {"and": [{"field": "os_name", "exists": True}], "or": []},
+])
+def test_malformed_nodes(node):
+    with pytest.raises(QueryError):
+        compile_filter(node)
+
+
+def test_size_and_depth_limits():
+    with pytest.raises(QueryError, match="too large"):
+        compile_filter({"and": [{"field": "os_name", "exists": True}] * QUERY_MAX_NODES})
+
+    node = {"field": "os_name", "exists": True}
+    for _ in range(QUERY_MAX_DEPTH + 1):
+        node = {"and": [node]}
+    with pytest.raises(QueryError, match="too deep"):
+        compile_filter(node)
+
+
+def test_estimated_rows_reads_the_filtered_scan():
+    plan = {
+        "Node Type": "Limit", "Plan Rows": 100,
+        "Plans": [{
+            "Node Type": "Nested Loop", "Join Type": "Anti", "Plan Rows": 1200,
+            "Plans": [
+                {
+                    "Node Type": "Bitmap Heap Scan", "Relation Name": "raw_inventory", "Alias": "r",
+                    "Plan Rows": 4800,
+                    "Plans": [{"Node Type": "Bitmap Index Scan", "Index Name": "idx_raw_inventory_payload"}]
+                },
+                {"Node Type": "Index Scan", "Relation Name": "raw_inventory", "Alias": "newer", "Plan Rows": 1},
+            ]
+        }]
+    }
+    assert _estimated_rows(plan, "r") == 4800
+    assert _estimated_rows(plan, "missing") is None
@@ -0,0 +1,33 @@
+-- Migração de bancos criados antes do log de alterações (/api/changes)
+-- e dos índices de busca/reprocessamento. Idempotente: pode ser aplicada
+-- mais de uma vez e também em bancos criados já com o schema.sql atual.
+-- Com shards, aplicar em cada banco de SHARD_URLS.
+
+CREATE TABLE IF NOT EXISTS device_changes (
+    seq BIGSERIAL PRIMARY KEY,
+    txid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    device_id VARCHAR(255) NOT NULL,
+    change_type VARCHAR(32) NOT NULL,
+    detail JSONB,
+    changed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT clock_timestamp()
+);
+
+CREATE INDEX IF NOT EXISTS idx_device_changes_position ON device_changes(txid, seq);
+CREATE INDEX IF NOT EXISTS idx_device_changes_changed_at ON device_changes(changed_at);
+
+-- Maior posição (txid, seq) já removida pela retenção: cursores anteriores
+-- a ela perderam alterações (410); uma linha só
+CREATE TABLE IF NOT EXISTS device_changes_pruned (
+    id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+    txid XID8 NOT NULL,
+    seq BIGINT NOT NULL
+);
+
+COMMENT ON TABLE device_changes IS 'Alterações de inventário (dispositivo novo, software, hardware, SO) em ordem de commit';
+
+-- Índices adicionados ao schema.sql junto com o log de alterações
+CREATE INDEX IF NOT EXISTS idx_raw_inventory_device_received ON raw_inventory(device_id, received_at DESC);
+CREATE INDEX IF NOT EXISTS idx_devices_ip_gist ON devices USING GIST(ip_address inet_ops);
+CREATE INDEX IF NOT EXISTS idx_devices_mac_norm ON devices((lower(regexp_replace(mac_address, '[^0-9A-Fa-f]', '', 'g'))));
+CREATE INDEX IF NOT EXISTS idx_network_interfaces_ip_gist ON network_interfaces USING GIST(ip_address inet_ops);
+CREATE INDEX IF NOT EXISTS idx_network_interfaces_mac_norm ON network_interfaces((lower(regexp_replace(mac_address, '[^0-9A-Fa-f]', '', 'g'))));
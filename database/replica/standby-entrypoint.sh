@@ -0,0 +1,15 @@
+#!/bin/sh
+# Inicializa a réplica com pg_basebackup (primeira execução) e sobe em hot standby
+set -e
+
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    echo "Clonando primário $PRIMARY_HOST..."
+    until pg_basebackup -h "$PRIMARY_HOST" -U replicator -D "$PGDATA" -R -X stream -P; do
+        echo "Primário indisponível, tentando novamente..."
+        rm -rf "$PGDATA"
+        sleep 2
+    done
+    chmod 700 "$PGDATA"
+fi
+
+exec postgres -c hot_standby=on
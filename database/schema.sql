@@ -15,6 +15,8 @@ CREATE TABLE IF NOT EXISTS raw_inventory (
 CREATE INDEX IF NOT EXISTS idx_raw_inventory_device_id ON raw_inventory(device_id);
 CREATE INDEX IF NOT EXISTS idx_raw_inventory_received_at ON raw_inventory(received_at DESC);
 CREATE INDEX IF NOT EXISTS idx_raw_inventory_payload ON raw_inventory USING GIN(payload);
+-- Payload mais recente por dispositivo (DISTINCT ON / reprocessamento)
+CREATE INDEX IF NOT EXISTS idx_raw_inventory_device_received ON raw_inventory(device_id, received_at DESC);
 
 -- Tabela principal de dispositivos (normalizada)
 CREATE TABLE IF NOT EXISTS devices (
@@ -42,6 +44,9 @@ CREATE TABLE IF NOT EXISTS devices (
 CREATE INDEX IF NOT EXISTS idx_devices_hostname ON devices(hostname);
 CREATE INDEX IF NOT EXISTS idx_devices_ip ON devices(ip_address);
 CREATE INDEX IF NOT EXISTS idx_devices_last_seen ON devices(last_seen DESC);
+-- Busca por IP/sub-rede (operadores inet &&, <<=) e por MAC normalizado (/api/lookup/*)
+CREATE INDEX IF NOT EXISTS idx_devices_ip_gist ON devices USING GIST(ip_address inet_ops);
+CREATE INDEX IF NOT EXISTS idx_devices_mac_norm ON devices((lower(regexp_replace(mac_address, '[^0-9A-Fa-f]', '', 'g'))));
 
 -- Tabela de software instalado
 CREATE TABLE IF NOT EXISTS software (
@@ -89,6 +94,8 @@ CREATE TABLE IF NOT EXISTS network_interfaces (
 
 CREATE INDEX IF NOT EXISTS idx_network_interfaces_device_id ON network_interfaces(device_id);
 CREATE INDEX IF NOT EXISTS idx_network_interfaces_ip ON network_interfaces(ip_address);
+CREATE INDEX IF NOT EXISTS idx_network_interfaces_ip_gist ON network_interfaces USING GIST(ip_address inet_ops);
+CREATE INDEX IF NOT EXISTS idx_network_interfaces_mac_norm ON network_interfaces((lower(regexp_replace(mac_address, '[^0-9A-Fa-f]', '', 'g'))));
 
 -- Tabela de usuários logados
 CREATE TABLE IF NOT EXISTS logged_users (
@@ -103,6 +110,32 @@ CREATE TABLE IF NOT EXISTS logged_users (
 
 CREATE INDEX IF NOT EXISTS idx_logged_users_device_id ON logged_users(device_id);
 
+-- Log de alterações por dispositivo (feed incremental /api/changes, ver api/changes.py)
+-- Lido na ordem (txid, seq) até o horizonte das transações já terminadas, sem
+-- serializar as gravações. Sem FK para devices: o histórico sobrevive à
+-- remoção/rebalanceamento do dispositivo
+CREATE TABLE IF NOT EXISTS device_changes (
+    seq BIGSERIAL PRIMARY KEY,
+    txid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    device_id VARCHAR(255) NOT NULL,
+    change_type VARCHAR(32) NOT NULL,
+    detail JSONB,
+    changed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT clock_timestamp()
+);
+
+-- Leitura do feed (keyset em txid, seq)
+CREATE INDEX IF NOT EXISTS idx_device_changes_position ON device_changes(txid, seq);
+-- Retenção (CHANGES_RETENTION_DAYS)
+CREATE INDEX IF NOT EXISTS idx_device_changes_changed_at ON device_changes(changed_at);
+
+-- Maior posição (txid, seq) já removida pela retenção: cursores anteriores
+-- a ela perderam alterações (410); uma linha só
+CREATE TABLE IF NOT EXISTS device_changes_pruned (
+    id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+    txid XID8 NOT NULL,
+    seq BIGINT NOT NULL
+);
+
 -- View para relatório consolidado de dispositivos
 CREATE OR REPLACE VIEW v_devices_summary AS
 SELECT 
@@ -157,4 +190,5 @@ COMMENT ON TABLE software IS 'Software instalado em cada dispositivo';
 COMMENT ON TABLE hardware_storage IS 'Informações de armazenamento (discos)';
 COMMENT ON TABLE network_interfaces IS 'Interfaces de rede de cada dispositivo';
 COMMENT ON TABLE logged_users IS 'Usuários que fizeram login nos dispositivos';
+COMMENT ON TABLE device_changes IS 'Alterações de inventário (dispositivo novo, software, hardware, SO) em ordem de commit';
 
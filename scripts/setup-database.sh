@@ -130,6 +130,13 @@ else
     fi
 fi
 
+# 3b. Migrações (idempotentes): atualizam bancos criados com um schema.sql anterior
+for migration in database/migrations/*.sql; do
+    [ -f "$migration" ] || continue
+    print_info "Aplicando migração $(basename "$migration")..."
+    $DOCKER_COMPOSE exec -T ocs-postgres psql -v ON_ERROR_STOP=1 -q -U ocsuser -d ocsinventory < "$migration"
+done
+
 # 4. Listar tabelas criadas
 print_info "Tabelas criadas:"
 $DOCKER_COMPOSE exec -T ocs-postgres psql -U ocsuser -d ocsinventory -c \